@@ -9,7 +9,47 @@ class Settings:
     db_path: str = "db/birthdays.sqlite3"
     timezone: str = os.getenv("TZ", "UTC")
     reminder_interval_minutes: int = 2
+    reminder_reping_every: int = 3
     admin_uid: Optional[int] = None
+    db_readers: int = 4
+    db_write_batch_size: int = 100
+    db_write_max_delay_ms: int = 2
+    db_slow_query_ms: int = 200
+    prefs_cache_size: int = 50_000
+    list_cache_size: int = 2_000
+    fsm_ttl_hours: int = 24
+    fsm_cache_mb: int = 8
+    delivery_workers: int = 8
+    tg_rate_limit: int = 30
+    tg_chat_rate_limit: int = 1
+    reminder_shards: int = 1
+    reminder_shard: int = 0
+    reminder_lease_ttl: int = 60
+    reminder_tick_budget_ms: int = 2000
+    reminder_jitter: bool = True
+    reminder_max_per_sec: int = 0
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 0
+    webhook_port: int = 0
+    webhook_host: str = "127.0.0.1"
+    webhook_path: str = "/webhook"
+    webhook_url: str = ""
+    webhook_secret: str = ""
+    webhook_max_concurrency: int = 64
+    webhook_drain_timeout: int = 30
+
+    @property
+    def process_count(self) -> int:
+        # процесс бота + воркеры напоминаний, если они вынесены отдельно
+        return 1 if self.reminder_shards == 1 else self.reminder_shards + 1
+
+
+def _int_env(name: str, default: int, minimum: int = 0) -> int:
+    try:
+        value = int(os.getenv(name, str(default)))
+    except ValueError:
+        value = default
+    return max(minimum, value)
 
 
 def load_settings() -> Settings:
@@ -27,6 +67,9 @@ def load_settings() -> Settings:
     # Безопасный минимум 5 минут
     if interval < 5:
         interval = 5
+    # Повторное напоминание в тот же день правит старое сообщение; каждое N-е — новый пуш
+    # (1 — всегда новый пуш, как раньше; 0 — только первое напоминание дня)
+    reminder_reping_every = _int_env("REMINDER_REPING_EVERY", 3)
     # Admin UID (optional)
     admin_s = os.getenv("ADMIN_UID", "").strip()
     admin_uid: Optional[int]
@@ -35,9 +78,76 @@ def load_settings() -> Settings:
     except ValueError:
         admin_uid = None
 
+    # SQLite: пул читателей и пакетная запись (group commit)
+    db_readers = _int_env("DB_READERS", 4, minimum=1)
+    db_write_batch_size = _int_env("DB_WRITE_BATCH_SIZE", 100, minimum=1)
+    db_write_max_delay_ms = _int_env("DB_WRITE_MAX_DELAY_MS", 2)
+    # Запросы дольше порога пишутся в лог вместе с EXPLAIN QUERY PLAN (0 — выключено)
+    db_slow_query_ms = _int_env("DB_SLOW_QUERY_MS", 200)
+    # Кэш настроек пользователей (LRU), записей (0 — выключен, для нескольких процессов бота)
+    prefs_cache_size = _int_env("PREFS_CACHE_SIZE", 50_000)
+    # Кэш отсортированных списков /list, пользователей (0 — выключен)
+    list_cache_size = _int_env("LIST_CACHE_SIZE", 2_000)
+    # Незаконченные диалоги (FSM) в SQLite: через сколько часов брошенный диалог забывается
+    # и сколько МБ держать в памяти (0 — без кэша, для нескольких процессов бота)
+    fsm_ttl_hours = _int_env("FSM_TTL_HOURS", 24, minimum=1)
+    fsm_cache_mb = _int_env("FSM_CACHE_MB", 8)
+    # Доставка: параллельные воркеры и лимиты Bot API (сообщений в секунду)
+    delivery_workers = _int_env("DELIVERY_WORKERS", 8, minimum=1)
+    tg_rate_limit = _int_env("TG_RATE_LIMIT", 30, minimum=1)
+    tg_chat_rate_limit = _int_env("TG_CHAT_RATE_LIMIT", 1, minimum=1)
+    # Напоминания в отдельных процессах (reminder_worker.py): число разделов uid и свой раздел
+    reminder_shards = _int_env("REMINDER_SHARDS", 1, minimum=1)
+    reminder_shard = _int_env("REMINDER_SHARD", 0)
+    reminder_lease_ttl = _int_env("REMINDER_LEASE_TTL", 60, minimum=10)
+    # Сколько мс один проход планировщика ставит напоминания в очередь, прежде чем уступить
+    reminder_tick_budget_ms = _int_env("REMINDER_TICK_BUDGET_MS", 2000, minimum=10)
+    # Сдвиг пользователя внутри интервала по uid (0 — все в :00) и общий потолок напоминаний в секунду (0 — нет)
+    reminder_jitter = _int_env("REMINDER_JITTER", 1) > 0
+    reminder_max_per_sec = _int_env("REMINDER_MAX_PER_SEC", 0)
+    # Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (0 — выключено)
+    metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+    metrics_port = _int_env("METRICS_PORT", 0)
+    # Webhook вместо long polling: сервер на WEBHOOK_HOST:WEBHOOK_PORT (0 — polling).
+    # WEBHOOK_URL — публичный адрес для setWebhook (пусто — webhook регистрируют снаружи).
+    webhook_port = _int_env("WEBHOOK_PORT", 0)
+    webhook_host = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+    webhook_path = "/" + os.getenv("WEBHOOK_PATH", "/webhook").strip().lstrip("/")
+    webhook_url = os.getenv("WEBHOOK_URL", "").strip()
+    webhook_secret = os.getenv("WEBHOOK_SECRET", "").strip()
+    webhook_max_concurrency = _int_env("WEBHOOK_MAX_CONCURRENCY", 64, minimum=1)
+    webhook_drain_timeout = _int_env("WEBHOOK_DRAIN_TIMEOUT", 30)
+
     return Settings(
         bot_token=token,
         db_path=db_path,
         reminder_interval_minutes=interval,
+        reminder_reping_every=reminder_reping_every,
         admin_uid=admin_uid,
+        db_readers=db_readers,
+        db_write_batch_size=db_write_batch_size,
+        db_write_max_delay_ms=db_write_max_delay_ms,
+        db_slow_query_ms=db_slow_query_ms,
+        prefs_cache_size=prefs_cache_size,
+        list_cache_size=list_cache_size,
+        fsm_ttl_hours=fsm_ttl_hours,
+        fsm_cache_mb=fsm_cache_mb,
+        delivery_workers=delivery_workers,
+        tg_rate_limit=tg_rate_limit,
+        tg_chat_rate_limit=tg_chat_rate_limit,
+        reminder_shards=reminder_shards,
+        reminder_shard=reminder_shard,
+        reminder_lease_ttl=reminder_lease_ttl,
+        reminder_tick_budget_ms=reminder_tick_budget_ms,
+        reminder_jitter=reminder_jitter,
+        reminder_max_per_sec=reminder_max_per_sec,
+        metrics_host=metrics_host,
+        metrics_port=metrics_port,
+        webhook_port=webhook_port,
+        webhook_host=webhook_host,
+        webhook_path=webhook_path,
+        webhook_url=webhook_url,
+        webhook_secret=webhook_secret,
+        webhook_max_concurrency=webhook_max_concurrency,
+        webhook_drain_timeout=webhook_drain_timeout,
     )
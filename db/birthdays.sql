@@ -8,11 +8,19 @@ CREATE TABLE IF NOT EXISTS birthdays (
     phone TEXT NULL,
     tg_nic TEXT NULL,
     tg_id INTEGER NULL,
-    already_remaind INTEGER NOT NULL DEFAULT 0
+    already_remaind INTEGER NOT NULL DEFAULT 0,  -- legacy, superseded by notified_on
+    notified_on TEXT NULL,           -- user's local YYYY-MM-DD on which "already congratulated" was pressed
+    mmdd INTEGER NULL                -- calendar key MM*100+DD (e.g. 0412 -> 412), see Database._ensure_columns
 );
 
 CREATE INDEX IF NOT EXISTS idx_birthdays_uid ON birthdays(uid);
 CREATE INDEX IF NOT EXISTS idx_birthdays_date ON birthdays(date);
+-- idx_birthdays_mmdd / idx_birthdays_uid_mmdd are created in Database._ensure_columns,
+-- after the mmdd column has been added to pre-existing databases.
+-- ux_birthdays_uid_friend_date (UNIQUE uid, friend, date) is created there too,
+-- once duplicates of older databases have been removed.
+-- birthdays_fts (FTS5 over friend, uid) and its triggers are created in
+-- Database._ensure_search_index, if SQLite has FTS5.
 
 -- For preventing spam: track last sent notification per (uid, birthday_id)
 CREATE TABLE IF NOT EXISTS last_notifications (
@@ -21,6 +29,7 @@ CREATE TABLE IF NOT EXISTS last_notifications (
     message_id INTEGER NOT NULL,
     date TEXT NOT NULL,              -- YYYY-MM-DD of when it was sent
     extra_message_id INTEGER NULL,
+    repeat_count INTEGER NOT NULL DEFAULT 0,  -- reminders sent or edited in place on `date`
     PRIMARY KEY (uid, birthday_id)
 );
 
@@ -28,5 +37,65 @@ CREATE TABLE IF NOT EXISTS last_notifications (
 CREATE TABLE IF NOT EXISTS user_prefs (
     uid INTEGER PRIMARY KEY,
     tz_offset INTEGER NOT NULL DEFAULT 0,   -- e.g., +3, -1
-    start_hour INTEGER NOT NULL DEFAULT 0   -- 0..23; send from this hour until 23:00 local
+    start_hour INTEGER NOT NULL DEFAULT 0,  -- 0..23; send from this hour until 23:00 local
+    digest INTEGER NOT NULL DEFAULT 0       -- 1: one digest message per interval instead of a reminder per birthday
 );
+
+-- Digest mode: the user's current digest message and the birthdays it lists
+CREATE TABLE IF NOT EXISTS last_digests (
+    uid INTEGER PRIMARY KEY,
+    message_id INTEGER NOT NULL,
+    date TEXT NOT NULL,              -- user's local YYYY-MM-DD the digest is for
+    birthday_ids TEXT NOT NULL,      -- comma-separated ids listed in the message, in order
+    repeat_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- Delivery outbox: the scheduler enqueues, a separate drain loop sends (see ReminderService).
+-- One row per (uid, birthday_id, local_date); repeat reminders re-arm the same row with a later slot.
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid INTEGER NOT NULL,
+    birthday_id INTEGER NOT NULL,
+    local_date TEXT NOT NULL,        -- user's local YYYY-MM-DD the reminder is for
+    slot TEXT NOT NULL,              -- UTC 'YYYY-MM-DD HH:MM:SS' of the tick that (re-)armed the row
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending | sending | sent | failed | dropped
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before TEXT NOT NULL,        -- UTC; retry backoff
+    enqueued_at TEXT NOT NULL,
+    sent_at TEXT NULL,
+    last_error TEXT NULL,
+    claimed_at TEXT NULL,            -- UTC; when a drain loop moved it to 'sending'
+    UNIQUE (uid, birthday_id, local_date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_status_slot ON outbox(status, slot);
+
+-- aiogram FSM state of unfinished dialogs (/add, /bulk, /settings, ...), see db/fsm.py
+CREATE TABLE IF NOT EXISTS fsm_state (
+    key TEXT PRIMARY KEY,            -- StorageKey built by aiogram's DefaultKeyBuilder
+    state TEXT NULL,
+    data TEXT NOT NULL DEFAULT '{}', -- JSON
+    updated_at REAL NOT NULL         -- unix time of the last write; abandoned rows are purged after FSM_TTL_HOURS
+);
+
+CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state(updated_at);
+
+-- Sharded reminder workers (REMINDER_SHARDS > 1): who owns which uid partition (uid % shards).
+-- home = 1 when the owner is the worker configured for this shard; a worker that took over
+-- a crashed partition (home = 0) hands it back as soon as the home worker shows up.
+CREATE TABLE IF NOT EXISTS reminder_leases (
+    shard INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    home INTEGER NOT NULL DEFAULT 0,
+    expires_at REAL NOT NULL         -- unix time
+);
+
+-- Last change per user (one row per uid, seq only grows), filled by triggers so that worker processes notice writes made by
+-- the bot process (in-process changes are delivered through Database.subscribe as well).
+CREATE TABLE IF NOT EXISTS change_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid INTEGER NOT NULL UNIQUE
+);
+-- Its triggers (trg_birthdays_*_log, trg_user_prefs_*_log) are created at the end of
+-- Database._ensure_columns, after the one-time migrations, which would otherwise log every row,
+-- and only with REMINDER_SHARDS > 1 (dropped otherwise).
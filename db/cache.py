@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+
+# Значения по умолчанию, если пользователь ничего не настраивал (см. user_prefs)
+DEFAULT_PREFS: tuple[int, int] = (0, 0)
+
+
+class PrefsCache:
+    """Bounded LRU of (tz_offset, start_hour) per uid.
+    Used from the event loop only, so no locking. Users without a user_prefs row are
+    cached with DEFAULT_PREFS as well, otherwise every lookup for them would be a miss.
+    max_entries=0 disables it (several bot processes: another one may change the prefs).
+    """
+
+    def __init__(self, max_entries: int = 50_000):
+        self.max_entries = max(0, max_entries)
+        self._data: OrderedDict[int, tuple[int, int]] = OrderedDict()
+        # bumped by every write-through put and invalidation: prefs read from the database
+        # before a concurrent write must not be cached over it
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, uid: int) -> Optional[tuple[int, int]]:
+        prefs = self._data.get(uid)
+        if prefs is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(uid)
+        self.hits += 1
+        return prefs
+
+    def put(self, uid: int, tz_offset: int, start_hour: int, version: Optional[int] = None) -> None:
+        """version=None: the caller has just written these prefs. Otherwise they were read
+        when `version` was current and are dropped if a write happened since."""
+        if version is None:
+            self.version += 1
+        elif version != self.version:
+            return
+        if not self.max_entries:
+            return
+        self._data[uid] = (int(tz_offset), int(start_hour))
+        self._data.move_to_end(uid)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, uid: int) -> None:
+        self.version += 1
+        self._data.pop(uid, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class ListItem(NamedTuple):
+    id: int
+    friend: str
+    date: str
+    mmdd: int
+
+
+class ListCache:
+    """Bounded LRU of /list orderings: uid -> (user's local date, items sorted soonest
+    first). The order depends on the local date, so an entry from another day is a miss.
+    Database drops a user's entry on each of their writes, so flipping pages costs no query.
+    """
+
+    def __init__(self, max_entries: int = 2_000):
+        self.max_entries = max(0, max_entries)
+        self._data: OrderedDict[int, tuple[str, list[ListItem]]] = OrderedDict()
+        # bumped by every invalidation: a list read before a concurrent write must not be cached
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, uid: int, local_date: str) -> Optional[list[ListItem]]:
+        entry = self._data.get(uid)
+        if entry is None or entry[0] != local_date:
+            self.misses += 1
+            return None
+        self._data.move_to_end(uid)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, uid: int, local_date: str, items: list[ListItem], version: int) -> None:
+        if not self.max_entries or version != self.version:
+            return
+        self._data[uid] = (local_date, items)
+        self._data.move_to_end(uid)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def invalidate(self, uid: int) -> None:
+        self.version += 1
+        self._data.pop(uid, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
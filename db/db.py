@@ -1,19 +1,164 @@
 import asyncio
+import calendar
+import datetime as dt
+import logging
 import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Iterable, Optional
+from typing import Any, Callable, Iterable, Optional, TypeVar
+
+from db.cache import DEFAULT_PREFS, ListCache, ListItem, PrefsCache
+from db.stats import QueryStats
+
+
+T = TypeVar("T")
+
+slow_log = logging.getLogger("db.slow")
+
+
+def mmdd_key(date: str) -> int:
+    # 'YYYY-MM-DD' -> MM*100+DD, индексируемый календарный ключ (год не важен)
+    return int(date[5:7]) * 100 + int(date[8:10])
+
+
+def mmdd_bounds(mm: str, dd: str, year: int | None = None) -> tuple[int, int]:
+    """Range of mmdd keys due on the given day.
+    29 Feb birthdays are celebrated on 28 Feb in non-leap years (same policy as days_until_next).
+    """
+    lo = int(mm) * 100 + int(dd)
+    hi = lo
+    if lo == 228 and year is not None and not calendar.isleap(year):
+        hi = 229
+    return lo, hi
+
+
+# /list: больше записей у пользователя — страницы читаются keyset-запросами, без кэша
+LIST_CACHE_MAX_ROWS = 5_000
+
+# Что пишется в change_log (см. birthdays.sql): таблица, событие, строка с uid
+CHANGE_LOG_TRIGGERS = (
+    ("birthdays", "INSERT", "NEW"),
+    ("birthdays", "UPDATE", "NEW"),
+    ("birthdays", "DELETE", "OLD"),
+    ("user_prefs", "INSERT", "NEW"),
+    ("user_prefs", "UPDATE", "NEW"),
+)
+
+# Текст имени для birthdays_fts (SQL, {} — NEW/OLD/birthdays): ё → е, остальное делает токенизатор
+FTS_TEXT = "replace(replace({}.friend, 'ё', 'е'), 'Ё', 'Е')"
+
+
+# Допустимые смещения часового пояса пользователя (см. handlers/settings._parse_tz)
+TZ_OFFSETS = range(-12, 15)
+
+
+def due_mmdd_keys(now_utc: dt.datetime, offsets: Iterable[int] | None = None) -> list[int]:
+    # All mmdd keys that are "today" somewhere in TZ_OFFSETS (or the given offsets) at the given UTC instant
+    keys: set[int] = set()
+    for off in (TZ_OFFSETS if offsets is None else offsets):
+        local = now_utc + dt.timedelta(hours=off)
+        lo, hi = mmdd_bounds(f"{local.month:02d}", f"{local.day:02d}", local.year)
+        keys.update(range(lo, hi + 1))
+    return sorted(keys)
+
+
+def _shard_where(column: str, shard: tuple[int, Iterable[int]], params: list[Any]) -> str:
+    # uid partition of sharded reminder workers: uid % count in ids
+    count, ids = shard
+    ids = list(ids) or [-1]
+    params += [count, *ids]
+    return f"{column} % ? IN ({', '.join('?' for _ in ids)})"
+
+
+@dataclass
+class _WriteTask:
+    fn: Callable[[sqlite3.Connection], Any]
+    loop: asyncio.AbstractEventLoop
+    future: asyncio.Future
+    # executescript commits on its own, so such tasks run outside of a batch transaction
+    standalone: bool = False
+
+
+def _row_count(result: Any) -> int:
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, sqlite3.Row):
+        return 1
+    if isinstance(result, sqlite3.Cursor):
+        return max(0, result.rowcount)  # rows affected by a write
+    return 0
+
+
+def _resolve(future: asyncio.Future, result: Any, error: BaseException | None) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+@dataclass
+class BulkResult:
+    added: int = 0
+    skipped: int = 0  # already present (uid, friend, date), in the DB or earlier in the same batch
+    errors: int = 0   # rows without a name or with a malformed date
 
 
 class Database:
-    def __init__(self, path: str):
+    """SQLite storage: a pool of read-only WAL connections for fetchone/fetchall and one
+    writer thread that group-commits queued writes, one transaction per batch.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        readers: int = 4,
+        write_batch_size: int = 100,
+        write_max_delay_ms: float = 2.0,
+        slow_query_ms: float = 200.0,
+        prefs_cache_size: int = 50_000,
+        list_cache_size: int = 2_000,
+        change_log: bool = False,
+    ):
         self.path = path
+        # triggers filling change_log; only sharded reminder workers read it (REMINDER_SHARDS > 1)
+        self.change_log = change_log
+        # per-statement timing, see db/stats.py; slow statements go to the "db.slow" logger
+        self.stats = QueryStats()
+        self._slow_query_s = max(0.0, slow_query_ms) / 1000
+        self.prefs_cache = PrefsCache(prefs_cache_size)
+        self.list_cache = ListCache(list_cache_size)
+        # FTS5 index on birthdays.friend, see _ensure_search_index
+        self.fts = False
+        self._listeners: list[Callable[[int], None]] = []
         os.makedirs(Path(path).parent, exist_ok=True)
-        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        # writer connection: autocommit mode, transactions are managed by the writer loop
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
         self._conn.row_factory = sqlite3.Row
-        with self._conn:
-            self._conn.execute("PRAGMA journal_mode=WAL;")
-            self._conn.execute("PRAGMA foreign_keys=ON;")
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA foreign_keys=ON;")
+        self._conn.execute("PRAGMA busy_timeout=5000;")
+
+        self._write_batch_size = max(1, write_batch_size)
+        self._write_max_delay = max(0.0, write_max_delay_ms) / 1000
+        self._writes: queue.Queue[_WriteTask | None] = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        self._writer.start()
+
+        ro_uri = Path(path).resolve().as_uri() + "?mode=ro"
+        self._readers: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._reader_conns: list[sqlite3.Connection] = []
+        for _ in range(max(1, readers)):
+            conn = sqlite3.connect(ro_uri, uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._reader_conns.append(conn)
+            self._readers.put(conn)
 
     async def initialize(self):
         sql_path = Path(__file__).with_name("birthdays.sql")
@@ -21,84 +166,401 @@ class Database:
         await self.execute_script(schema_sql)
         # ensure new columns for existing DBs
         await self._ensure_columns()
+        await self._ensure_search_index()
+        await self.warm_prefs_cache()
 
     async def _ensure_columns(self) -> None:
-        def run():
-            cur = self._conn.execute("PRAGMA table_info(birthdays)")
+        def run(conn: sqlite3.Connection):
+            cur = conn.execute("PRAGMA table_info(birthdays)")
             cols = {row[1] for row in cur.fetchall()}
-            with self._conn:
-                if "tg_id" not in cols:
-                    self._conn.execute("ALTER TABLE birthdays ADD COLUMN tg_id INTEGER NULL")
-                # last_notifications extra column
-                cur2 = self._conn.execute("PRAGMA table_info(last_notifications)")
-                cols2 = {row[1] for row in cur2.fetchall()}
-                if "extra_message_id" not in cols2:
-                    self._conn.execute("ALTER TABLE last_notifications ADD COLUMN extra_message_id INTEGER NULL")
-                # ensure user_prefs table exists
-                self._conn.execute(
-                    "CREATE TABLE IF NOT EXISTS user_prefs ("
-                    " uid INTEGER PRIMARY KEY,"
-                    " tz_offset INTEGER NOT NULL DEFAULT 0,"
-                    " start_hour INTEGER NOT NULL DEFAULT 0"
-                    ")"
+            if "tg_id" not in cols:
+                conn.execute("ALTER TABLE birthdays ADD COLUMN tg_id INTEGER NULL")
+            # calendar key for index lookups instead of `date LIKE '%-MM-DD'`
+            if "mmdd" not in cols:
+                conn.execute("ALTER TABLE birthdays ADD COLUMN mmdd INTEGER NULL")
+            # «уже поздравил» хранится как локальная дата; старый флаг переносим один раз
+            if "notified_on" not in cols:
+                conn.execute("ALTER TABLE birthdays ADD COLUMN notified_on TEXT NULL")
+                # флаг ставили «сегодня» — это сегодня по часовому поясу пользователя, а не по UTC
+                conn.execute(
+                    "UPDATE birthdays SET already_remaind = 0, notified_on = date('now', printf('%+d hours',"
+                    " COALESCE((SELECT p.tz_offset FROM user_prefs p WHERE p.uid = birthdays.uid), 0))) "
+                    "WHERE already_remaind = 1"
+                )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_birthdays_mmdd ON birthdays(mmdd)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_birthdays_uid_mmdd ON birthdays(uid, mmdd)")
+            conn.execute(
+                "UPDATE birthdays SET mmdd = CAST(substr(date, 6, 2) AS INTEGER) * 100 + CAST(substr(date, 9, 2) AS INTEGER) "
+                "WHERE mmdd IS NULL"
+            )
+            # (uid, friend, date) is unique: bulk import resolves duplicates with ON CONFLICT.
+            # Older databases may already contain duplicates — keep the earliest row, but first
+            # copy into it what only the later ones have (phone, tg, "congratulated").
+            has_unique = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ux_birthdays_uid_friend_date'"
+            ).fetchone()
+            if not has_unique:
+                def dup(col: str) -> str:
+                    return (
+                        f"(SELECT d.{col} FROM birthdays d WHERE d.uid = birthdays.uid AND d.friend = birthdays.friend"
+                        f" AND d.date = birthdays.date AND d.{col} IS NOT NULL ORDER BY d.id LIMIT 1)"
+                    )
+
+                conn.execute(
+                    f"UPDATE birthdays SET phone = COALESCE(phone, {dup('phone')}),"
+                    f" tg_nic = COALESCE(tg_nic, {dup('tg_nic')}),"
+                    f" tg_id = COALESCE(tg_id, {dup('tg_id')}),"
+                    " notified_on = (SELECT MAX(d.notified_on) FROM birthdays d"
+                    "  WHERE d.uid = birthdays.uid AND d.friend = birthdays.friend AND d.date = birthdays.date) "
+                    "WHERE id IN (SELECT MIN(id) FROM birthdays GROUP BY uid, friend, date HAVING COUNT(*) > 1)"
+                )
+                conn.execute(
+                    "DELETE FROM last_notifications WHERE birthday_id IN ("
+                    " SELECT id FROM birthdays WHERE id NOT IN (SELECT MIN(id) FROM birthdays GROUP BY uid, friend, date))"
+                )
+                removed = conn.execute(
+                    "DELETE FROM birthdays WHERE id NOT IN (SELECT MIN(id) FROM birthdays GROUP BY uid, friend, date)"
+                ).rowcount
+                if removed:
+                    logging.warning(f"Миграция: удалено {removed} дублей (uid, имя, дата), их телефоны и tg перенесены в оставшиеся записи")
+                conn.execute("CREATE UNIQUE INDEX ux_birthdays_uid_friend_date ON birthdays(uid, friend, date)")
+            # last_notifications extra column
+            cur2 = conn.execute("PRAGMA table_info(last_notifications)")
+            cols2 = {row[1] for row in cur2.fetchall()}
+            if "extra_message_id" not in cols2:
+                conn.execute("ALTER TABLE last_notifications ADD COLUMN extra_message_id INTEGER NULL")
+            # how many reminders of this birthday went out on `date` (fresh pushes and in-place edits)
+            if "repeat_count" not in cols2:
+                conn.execute("ALTER TABLE last_notifications ADD COLUMN repeat_count INTEGER NOT NULL DEFAULT 0")
+            # ensure user_prefs table exists
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_prefs ("
+                " uid INTEGER PRIMARY KEY,"
+                " tz_offset INTEGER NOT NULL DEFAULT 0,"
+                " start_hour INTEGER NOT NULL DEFAULT 0"
+                ")"
+            )
+            cols3 = {row[1] for row in conn.execute("PRAGMA table_info(user_prefs)").fetchall()}
+            if "digest" not in cols3:
+                conn.execute("ALTER TABLE user_prefs ADD COLUMN digest INTEGER NOT NULL DEFAULT 0")
+            cols4 = {row[1] for row in conn.execute("PRAGMA table_info(outbox)").fetchall()}
+            if "claimed_at" not in cols4:
+                conn.execute("ALTER TABLE outbox ADD COLUMN claimed_at TEXT NULL")
+            # change_log triggers last: the backfills above must not mark every user as changed.
+            # Without workers nobody reads change_log — don't pay for it on every write.
+            for table, event, row in CHANGE_LOG_TRIGGERS:
+                name = f"trg_{table}_{event.lower()}_log"
+                if not self.change_log:
+                    conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+                    continue
+                conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN"
+                    f" DELETE FROM change_log WHERE uid = {row}.uid;"
+                    f" INSERT INTO change_log(uid) VALUES ({row}.uid); END"
                 )
 
-        await asyncio.to_thread(run)
+        await self._write(run, "migration: _ensure_columns", explain=False)
 
-    async def execute(self, query: str, params: Iterable[Any] | None = None) -> None:
-        def run():
-            with self._conn:
-                self._conn.execute(query, tuple(params or []))
+    async def _ensure_search_index(self) -> None:
+        # Full-text index over birthdays.friend, kept in sync by triggers. Contentless: it only
+        # maps words to birthdays.id, and the words are indexed with ё folded into е (unicode61
+        # folds case of any script, but not ё). Prefix indexes keep "в*", "ва*", "вас*" cheap
+        # while the inline query is being typed. uid is indexed too, so MATCH intersects with
+        # the user's own rows instead of walking everybody's matches.
+        def run(conn: sqlite3.Connection) -> bool:
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'birthdays_fts'").fetchone()
+            try:
+                conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS birthdays_fts USING fts5("
+                    " friend, uid, content='', tokenize='unicode61', prefix='1 2 3')"
+                )
+            except sqlite3.OperationalError as e:
+                # SQLite собран без FTS5 — поиск работает перебором записей пользователя
+                logging.warning(f"FTS5 недоступен ({e}), поиск по имени без индекса")
+                return False
+            # 'delete' must be given exactly the values that were indexed
+            new = f"NEW.id, {FTS_TEXT.format('NEW')}, NEW.uid"
+            old = f"'delete', OLD.id, {FTS_TEXT.format('OLD')}, OLD.uid"
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS trg_birthdays_fts_insert AFTER INSERT ON birthdays BEGIN"
+                f" INSERT INTO birthdays_fts(rowid, friend, uid) VALUES ({new}); END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS trg_birthdays_fts_delete AFTER DELETE ON birthdays BEGIN"
+                f" INSERT INTO birthdays_fts(birthdays_fts, rowid, friend, uid) VALUES ({old}); END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS trg_birthdays_fts_update AFTER UPDATE OF friend, uid ON birthdays BEGIN"
+                f" INSERT INTO birthdays_fts(birthdays_fts, rowid, friend, uid) VALUES ({old});"
+                f" INSERT INTO birthdays_fts(rowid, friend, uid) VALUES ({new}); END"
+            )
+            if not exists:
+                conn.execute(
+                    "INSERT INTO birthdays_fts(rowid, friend, uid) "
+                    f"SELECT id, {FTS_TEXT.format('birthdays')}, uid FROM birthdays"
+                )
+            return True
 
-        await asyncio.to_thread(run)
+        self.fts = await self._write(run, "migration: _ensure_search_index", explain=False)
 
-    async def execute_script(self, script: str) -> None:
-        def run():
-            with self._conn:
-                self._conn.executescript(script)
+    # Storage engine: batching writer + reader pool
+    def _writer_loop(self) -> None:
+        stop = False
+        while not stop:
+            task = self._writes.get()
+            if task is None:
+                break
+            batch = [task]
+            deadline = time.monotonic() + self._write_max_delay
+            while len(batch) < self._write_batch_size:
+                try:
+                    timeout = deadline - time.monotonic()
+                    nxt = self._writes.get(timeout=timeout) if timeout > 0 else self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+            self._run_batch(batch)
 
-        await asyncio.to_thread(run)
+    def _run_batch(self, batch: list[_WriteTask]) -> None:
+        done: list[tuple[_WriteTask, Any, BaseException | None]] = []
+        pending: list[_WriteTask] = []
 
-    async def fetchone(self, query: str, params: Iterable[Any] | None = None) -> Optional[sqlite3.Row]:
-        def run():
-            cur = self._conn.execute(query, tuple(params or []))
-            return cur.fetchone()
+        def flush() -> None:
+            if not pending:
+                return
+            results: list[tuple[_WriteTask, Any, BaseException | None]] = []
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                for t in pending:
+                    # a failing statement must not take the rest of the batch down with it
+                    self._conn.execute("SAVEPOINT task")
+                    try:
+                        res = t.fn(self._conn)
+                    except Exception as e:
+                        self._conn.execute("ROLLBACK TO task")
+                        self._conn.execute("RELEASE task")
+                        results.append((t, None, e))
+                    else:
+                        self._conn.execute("RELEASE task")
+                        results.append((t, res, None))
+                self._conn.execute("COMMIT")
+            except Exception as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                results = [(t, None, e) for t in pending]
+            done.extend(results)
+            pending.clear()
 
-        return await asyncio.to_thread(run)
+        for t in batch:
+            if t.standalone:
+                flush()
+                try:
+                    done.append((t, t.fn(self._conn), None))
+                except Exception as e:
+                    done.append((t, None, e))
+            else:
+                pending.append(t)
+        flush()
+        for t, res, err in done:
+            try:
+                t.loop.call_soon_threadsafe(_resolve, t.future, res, err)
+            except RuntimeError:
+                # event loop is already closed (shutdown) — nobody is waiting
+                pass
 
-    async def fetchall(self, query: str, params: Iterable[Any] | None = None) -> list[sqlite3.Row]:
-        def run():
-            cur = self._conn.execute(query, tuple(params or []))
-            return cur.fetchall()
+    def _instrument(
+        self, fn: Callable[[sqlite3.Connection], T], sql: str, params: tuple, explain: bool
+    ) -> Callable[[sqlite3.Connection], T]:
+        # queue time: from the call until a connection/thread picks the statement up;
+        # exec time: inside SQLite
+        submitted = time.perf_counter()
+
+        def run(conn: sqlite3.Connection) -> T:
+            started = time.perf_counter()
+            try:
+                result = fn(conn)
+            except Exception:
+                self.stats.record(sql, started - submitted, time.perf_counter() - started, error=True)
+                raise
+            elapsed = time.perf_counter() - started
+            self.stats.record(sql, started - submitted, elapsed, _row_count(result))
+            if self._slow_query_s and elapsed >= self._slow_query_s:
+                self._log_slow(conn, sql, params, started - submitted, elapsed, _row_count(result), explain)
+            return result
+
+        return run
+
+    def _log_slow(
+        self, conn: sqlite3.Connection, sql: str, params: tuple, queue_s: float, exec_s: float, rows: int, explain: bool
+    ) -> None:
+        plan = ""
+        if explain:
+            try:
+                plan_rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+                plan = "\n".join(f"  {r[3]}" for r in plan_rows)
+            except sqlite3.Error as e:
+                plan = f"  (plan unavailable: {e})"
+        slow_log.warning(
+            "slow query %.1f ms (queued %.1f ms, rows %s): %s%s",
+            exec_s * 1000,
+            queue_s * 1000,
+            rows,
+            " ".join(sql.split()),
+            ("\n" + plan) if plan else "",
+        )
+
+    async def _write(
+        self,
+        fn: Callable[[sqlite3.Connection], T],
+        sql: str,
+        params: tuple = (),
+        standalone: bool = False,
+        explain: bool = True,
+    ) -> T:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._writes.put(_WriteTask(self._instrument(fn, sql, params, explain), loop, future, standalone))
+        return await future
+
+    async def _read(self, fn: Callable[[sqlite3.Connection], T], sql: str, params: tuple = ()) -> T:
+        timed = self._instrument(fn, sql, params, explain=True)
+
+        def run() -> T:
+            conn = self._readers.get()
+            try:
+                return timed(conn)
+            finally:
+                self._readers.put(conn)
 
         return await asyncio.to_thread(run)
 
+    def close(self) -> None:
+        # pending writes are flushed before the writer thread exits
+        self._writes.put(None)
+        self._writer.join()
+        for conn in self._reader_conns:
+            conn.close()
+        self._conn.close()
+
+    def subscribe(self, callback: Callable[[int], None]) -> None:
+        """Call callback(uid) after every domain write that changes what is due for uid
+        (birthdays added/edited/deleted/congratulated, prefs changed). Runs in the event loop."""
+        self._listeners.append(callback)
+
+    def _changed(self, uid: int) -> None:
+        self.list_cache.invalidate(uid)
+        for cb in self._listeners:
+            try:
+                cb(uid)
+            except Exception:
+                logging.exception("db change listener failed")
+
+    async def execute(self, query: str, params: Iterable[Any] | None = None) -> None:
+        args = tuple(params or [])
+        await self._write(lambda conn: conn.execute(query, args), query, args)
+
+    async def execute_script(self, script: str) -> None:
+        label = "script: " + " ".join(script.split())[:80]
+        await self._write(lambda conn: conn.executescript(script), label, standalone=True, explain=False)
+
+    async def fetchone(self, query: str, params: Iterable[Any] | None = None) -> Optional[sqlite3.Row]:
+        args = tuple(params or [])
+        return await self._read(lambda conn: conn.execute(query, args).fetchone(), query, args)
+
+    async def fetchall(self, query: str, params: Iterable[Any] | None = None) -> list[sqlite3.Row]:
+        args = tuple(params or [])
+        return await self._read(lambda conn: conn.execute(query, args).fetchall(), query, args)
+
     # Domain-specific helpers
-    async def add_birthday(self, uid: int, date: str, friend: str, phone: Optional[str], tg_nic: Optional[str] = None) -> int:
-        def run() -> int:
-            with self._conn:
-                cur = self._conn.execute(
-                    "INSERT INTO birthdays (uid, date, friend, phone, tg_nic, already_remaind) VALUES (?, ?, ?, ?, ?, 0)",
-                    (uid, date, friend, phone, tg_nic),
-                )
-                return int(cur.lastrowid)
+    async def add_birthday(
+        self, uid: int, date: str, friend: str, phone: Optional[str], tg_nic: Optional[str] = None
+    ) -> tuple[int, bool]:
+        """(id, created): created is False when (uid, friend, date) already existed; id is then the existing row's."""
+        def run(conn: sqlite3.Connection) -> tuple[int, bool]:
+            cur = conn.execute(
+                "INSERT INTO birthdays (uid, date, friend, phone, tg_nic, mmdd, already_remaind) VALUES (?, ?, ?, ?, ?, ?, 0) "
+                "ON CONFLICT(uid, friend, date) DO NOTHING",
+                (uid, date, friend, phone, tg_nic, mmdd_key(date)),
+            )
+            if cur.rowcount:
+                return int(cur.lastrowid), True
+            # такая запись уже есть — вернём её id
+            row = conn.execute(
+                "SELECT id FROM birthdays WHERE uid = ? AND friend = ? AND date = ?",
+                (uid, friend, date),
+            ).fetchone()
+            return int(row["id"]), False
 
-        return await asyncio.to_thread(run)
+        bid, created = await self._write(run, "add_birthday: INSERT INTO birthdays ... ON CONFLICT DO NOTHING", explain=False)
+        if created:
+            self._changed(uid)
+        return bid, created
 
-    async def find_birthday_by_friend_date(self, uid: int, friend: str, date: str) -> Optional[int]:
-        row = await self.fetchone(
-            "SELECT id FROM birthdays WHERE uid = ? AND friend = ? AND date = ?",
-            (uid, friend, date),
-        )
-        return int(row["id"]) if row else None
+    async def bulk_add_birthdays(self, uid: int, items: Iterable[dict]) -> BulkResult:
+        """Insert parsed {friend, date, phone?, tg_nic?} rows in one transaction.
+        Rows go to a temp staging table with executemany, then into birthdays with
+        ON CONFLICT DO NOTHING against ux_birthdays_uid_friend_date.
+        """
+        res = BulkResult()
+        staged: list[tuple] = []
+        for it in items:
+            friend = (it.get("friend") or "").strip()
+            date = it.get("date") or ""
+            try:
+                key = mmdd_key(date)
+            except (ValueError, TypeError):
+                key = None
+            if not friend or key is None:
+                res.errors += 1
+                continue
+            staged.append((friend, date, it.get("phone"), it.get("tg_nic"), key))
+        if not staged:
+            return res
+
+        def run(conn: sqlite3.Connection) -> int:
+            conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS bulk_stage ("
+                " friend TEXT NOT NULL, date TEXT NOT NULL, phone TEXT NULL, tg_nic TEXT NULL, mmdd INTEGER NOT NULL)"
+            )
+            conn.execute("DELETE FROM bulk_stage")
+            conn.executemany("INSERT INTO bulk_stage (friend, date, phone, tg_nic, mmdd) VALUES (?, ?, ?, ?, ?)", staged)
+            cur = conn.execute(
+                "INSERT INTO birthdays (uid, date, friend, phone, tg_nic, mmdd, already_remaind) "
+                "SELECT ?, date, friend, phone, tg_nic, mmdd, 0 FROM bulk_stage WHERE true ORDER BY rowid "
+                "ON CONFLICT(uid, friend, date) DO NOTHING",
+                (uid,),
+            )
+            added = cur.rowcount
+            conn.execute("DELETE FROM bulk_stage")
+            return added
+
+        res.added = await self._write(run, "bulk_add_birthdays: INSERT INTO birthdays SELECT ... FROM bulk_stage", explain=False)
+        res.skipped = len(staged) - res.added
+        if res.added:
+            self._changed(uid)
+        return res
 
     async def update_birthday_field(self, uid: int, bid: int, field: str, value: Any) -> bool:
-        assert field in {"date", "friend", "phone", "tg_nic", "tg_id", "already_remaind"}
-        res = await self.execute(
-            f"UPDATE birthdays SET {field} = ? WHERE id = ? AND uid = ?",
-            (value, bid, uid),
-        )
-        # sqlite doesn't return rowcount without cursor access; verify existence on fetch if needed.
+        assert field in {"date", "friend", "phone", "tg_nic", "tg_id", "notified_on"}
+        try:
+            if field == "date":
+                # keep the calendar key in sync with the date
+                await self.execute(
+                    "UPDATE birthdays SET date = ?, mmdd = ? WHERE id = ? AND uid = ?",
+                    (value, mmdd_key(value), bid, uid),
+                )
+            else:
+                await self.execute(
+                    f"UPDATE birthdays SET {field} = ? WHERE id = ? AND uid = ?",
+                    (value, bid, uid),
+                )
+        except sqlite3.IntegrityError:
+            # another record with the same (friend, date) already exists
+            return False
+        self._changed(uid)
         return True
 
     async def get_birthday(self, uid: int, bid: int) -> Optional[sqlite3.Row]:
@@ -108,12 +570,96 @@ class Database:
         await self.execute("DELETE FROM birthdays WHERE id = ? AND uid = ?", (bid, uid))
         # Also cleanup last notifications for this record
         await self.execute("DELETE FROM last_notifications WHERE uid = ? AND birthday_id = ?", (uid, bid))
+        self._changed(uid)
 
-    async def list_birthdays_page(self, uid: int, limit: int, offset: int) -> list[sqlite3.Row]:
-        return await self.fetchall(
-            "SELECT * FROM birthdays WHERE uid = ? ORDER BY substr(date, 6, 2), substr(date, 9, 2), friend LIMIT ? OFFSET ?",
-            (uid, limit, offset),
+    async def list_birthdays_keyset(
+        self,
+        uid: int,
+        today_mmdd: int,
+        cursor: tuple[int, int] | None = None,
+        backward: bool = False,
+        limit: int = 5,
+    ) -> list[sqlite3.Row]:
+        """A page of the user's birthdays ordered "soonest first": by mmdd rotated around
+        today_mmdd, then id. cursor is (mmdd, id) of the row the page starts after
+        (or, with backward=True, ends before); None means the beginning (the end).
+        Both halves of the rotation are index ranges on idx_birthdays_uid_mmdd.
+        """
+        upcoming = (today_mmdd, 9999)   # today .. end of year
+        wrapped = (0, today_mmdd - 1)   # beginning of year .. yesterday
+        if not backward:
+            segments = [upcoming, wrapped]
+            if cursor is not None and cursor[0] < today_mmdd:
+                segments = [wrapped]
+            op, order, start = ">", "ASC", (-1, -1)
+        else:
+            segments = [wrapped, upcoming]
+            if cursor is not None and cursor[0] >= today_mmdd:
+                segments = [upcoming]
+            op, order, start = "<", "DESC", (10000, 0)
+        rows: list[sqlite3.Row] = []
+        for i, (lo, hi) in enumerate(segments):
+            cm, cid = cursor if (cursor is not None and i == 0) else start
+            # narrow the mmdd range to the cursor so the index seek starts right there
+            if backward:
+                hi = min(hi, cm)
+            else:
+                lo = max(lo, cm)
+            rows += await self.fetchall(
+                "SELECT * FROM birthdays WHERE uid = ? AND mmdd BETWEEN ? AND ? "
+                f"AND (mmdd, id) {op} (?, ?) ORDER BY mmdd {order}, id {order} LIMIT ?",
+                (uid, lo, hi, cm, cid, limit - len(rows)),
+            )
+            if len(rows) >= limit:
+                break
+        if backward:
+            rows.reverse()
+        return rows
+
+    async def list_birthdays_sorted(self, uid: int, local_date: str) -> Optional[list[ListItem]]:
+        """All of the user's birthdays for /list, soonest first relative to local_date
+        (the same order as list_birthdays_keyset), from list_cache when possible.
+        None if the user has more than LIST_CACHE_MAX_ROWS: page those with the keyset query."""
+        cached = self.list_cache.get(uid, local_date)
+        if cached is not None:
+            return cached
+        version = self.list_cache.version
+        rows = await self.fetchall(
+            "SELECT id, friend, date, mmdd FROM birthdays WHERE uid = ? LIMIT ?",
+            (uid, LIST_CACHE_MAX_ROWS + 1),
         )
+        if len(rows) > LIST_CACHE_MAX_ROWS:
+            return None
+        today = int(local_date[5:7]) * 100 + int(local_date[8:10])
+        items = sorted(
+            (ListItem(int(r["id"]), r["friend"], r["date"], int(r["mmdd"])) for r in rows),
+            key=lambda it: (it.mmdd < today, it.mmdd, it.id),
+        )
+        self.list_cache.put(uid, local_date, items, version)
+        return items
+
+    async def search_birthdays(self, uid: int, query: str, limit: int = 20) -> list[sqlite3.Row]:
+        """The user's birthdays whose name has words starting with every word of the query
+        ("вас пуп" finds "Василий Пупкин"), best match first. Case and ё/е are ignored."""
+        words = re.findall(r"\w+", query.casefold().replace("ё", "е"))[:8]
+        if not words:
+            return []
+        if self.fts:
+            match = f'uid:"{int(uid)}" AND ' + " AND ".join(f'friend:"{w}"*' for w in words)
+            return await self.fetchall(
+                "SELECT b.* FROM birthdays_fts JOIN birthdays b ON b.id = birthdays_fts.rowid "
+                "WHERE birthdays_fts MATCH ? AND b.uid = ? "
+                "ORDER BY bm25(birthdays_fts, 1.0, 0.0), b.friend LIMIT ?",
+                (match, uid, limit),
+            )
+        # без FTS5: те же правила перебором записей одного пользователя
+        found = []
+        for row in await self.list_birthdays_all(uid):
+            names = re.findall(r"\w+", row["friend"].casefold().replace("ё", "е"))
+            if all(any(n.startswith(w) for n in names) for w in words):
+                found.append(row)
+        found.sort(key=lambda r: r["friend"].casefold())
+        return found[:limit]
 
     async def list_birthdays_all(self, uid: int) -> list[sqlite3.Row]:
         return await self.fetchall(
@@ -125,36 +671,89 @@ class Database:
         row = await self.fetchone("SELECT COUNT(*) AS c FROM birthdays WHERE uid = ?", (uid,))
         return int(row["c"]) if row else 0
 
-    async def select_today_not_notified(self, mm: str, dd: str) -> list[sqlite3.Row]:
-        like = f"%-{mm}-{dd}"
-        return await self.fetchall(
-            "SELECT * FROM birthdays WHERE date LIKE ? AND already_remaind = 0",
-            (like,),
+    async def _select_today(
+        self,
+        now_utc: dt.datetime,
+        select: str,
+        uids: Iterable[int] | None = None,
+        offsets: Iterable[int] | None = None,
+        tail: str = "",
+        shard: tuple[int, Iterable[int]] | None = None,
+    ) -> list[sqlite3.Row]:
+        # Birthdays that are "today" and not yet congratulated in each user's own timezone.
+        # Local time is derived in SQL from user_prefs.tz_offset; candidates are narrowed
+        # by the mmdd index to the dates that are today somewhere on Earth.
+        offsets = list(offsets) if offsets is not None else None
+        keys = due_mmdd_keys(now_utc, offsets)
+        if not keys:
+            return []
+        now_s = now_utc.strftime("%Y-%m-%d %H:%M:%S")
+        where = [f"b.mmdd IN ({', '.join('?' for _ in keys)})"]
+        params: list[Any] = [now_s, *keys]
+        if offsets is not None:
+            where.append(f"COALESCE(p.tz_offset, 0) IN ({', '.join('?' for _ in offsets)})")
+            params += offsets
+        if shard is not None:
+            where.append(_shard_where("b.uid", shard, params))
+        outer = (
+            "notified_on IS NOT date(local_ts)"
+            " AND (mmdd = CAST(strftime('%m%d', local_ts) AS INTEGER)"
+            "  OR (mmdd = 229 AND strftime('%m%d', local_ts) = '0228' AND strftime('%d', local_ts, '+1 day') = '01'))"
         )
-
-    async def select_today_all(self, mm: str, dd: str) -> list[sqlite3.Row]:
-        like = f"%-{mm}-{dd}"
-        return await self.fetchall(
-            "SELECT * FROM birthdays WHERE date LIKE ?",
-            (like,),
+        sql = (
+            f"SELECT {select} FROM ("
+            " SELECT b.*,"
+            "  COALESCE(p.tz_offset, 0) AS tz_offset,"
+            "  COALESCE(p.start_hour, 0) AS start_hour,"
+            "  datetime(?, printf('%+d hours', COALESCE(p.tz_offset, 0))) AS local_ts"
+            " FROM birthdays b"
+            " LEFT JOIN user_prefs p ON p.uid = b.uid"
+            " WHERE {where}"
+            f") WHERE {outer} {tail}"
         )
+        if uids is None:
+            return await self.fetchall(sql.format(where=" AND ".join(where)), params)
+        # IN-списки по uid режем на куски: лимит SQLite на число параметров
+        uids = list(uids)
+        rows: list[sqlite3.Row] = []
+        for i in range(0, len(uids), 500):
+            chunk = uids[i:i + 500]
+            chunk_where = where + [f"b.uid IN ({', '.join('?' for _ in chunk)})"]
+            rows += await self.fetchall(sql.format(where=" AND ".join(chunk_where)), params + chunk)
+        return rows
 
-    async def select_user_today_not_notified(self, uid: int, mm: str, dd: str) -> list[sqlite3.Row]:
-        like = f"%-{mm}-{dd}"
+    async def select_user_today(self, uid: int, local_date: str) -> list[sqlite3.Row]:
+        """One user's birthdays falling on local_date, via idx_birthdays_uid_mmdd: costs the
+        user's rows, not the table. 29 Feb counts on 28 Feb in non-leap years."""
+        lo, hi = mmdd_bounds(local_date[5:7], local_date[8:10], int(local_date[:4]))
         return await self.fetchall(
-            "SELECT * FROM birthdays WHERE uid = ? AND date LIKE ? AND already_remaind = 0",
-            (uid, like),
+            "SELECT * FROM birthdays WHERE uid = ? AND mmdd BETWEEN ? AND ? ORDER BY id",
+            (uid, lo, hi),
         )
 
-    async def select_user_today_all(self, uid: int, mm: str, dd: str) -> list[sqlite3.Row]:
-        like = f"%-{mm}-{dd}"
-        return await self.fetchall(
-            "SELECT * FROM birthdays WHERE uid = ? AND date LIKE ?",
-            (uid, like),
+    async def select_agenda(
+        self,
+        now_utc: dt.datetime,
+        uids: Iterable[int] | None = None,
+        offsets: Iterable[int] | None = None,
+        shard: tuple[int, Iterable[int]] | None = None,
+    ) -> list[sqlite3.Row]:
+        """(uid, id, tz_offset, start_hour, local_date) of birthdays the users have not
+        congratulated yet on their local today, regardless of the sending window.
+        shard=(count, ids) keeps only uids with uid % count in ids."""
+        return await self._select_today(
+            now_utc,
+            "uid, id, tz_offset, start_hour, date(local_ts) AS local_date",
+            uids=uids,
+            offsets=offsets,
+            tail="ORDER BY uid, id",
+            shard=shard,
         )
 
-    async def mark_notified_today(self, uid: int, bid: int) -> None:
-        await self.execute("UPDATE birthdays SET already_remaind = 1 WHERE id = ? AND uid = ?", (bid, uid))
+    async def mark_notified_today(self, uid: int, bid: int, local_date: str) -> None:
+        # local_date: 'YYYY-MM-DD' in the user's timezone; nothing has to be reset at midnight
+        await self.execute("UPDATE birthdays SET notified_on = ? WHERE id = ? AND uid = ?", (local_date, bid, uid))
+        self._changed(uid)
 
     # last_notifications helpers
     async def get_last_notification(self, uid: int, bid: int) -> Optional[sqlite3.Row]:
@@ -164,23 +763,302 @@ class Database:
         )
 
     async def upsert_last_notification(
-        self, uid: int, bid: int, message_id: int, date: str, extra_message_id: int | None = None
+        self,
+        uid: int,
+        bid: int,
+        message_id: int,
+        date: str,
+        extra_message_id: int | None = None,
+        repeat_count: int = 1,
     ) -> None:
         await self.execute(
-            "INSERT INTO last_notifications(uid, birthday_id, message_id, date, extra_message_id) VALUES(?, ?, ?, ?, ?) "
-            "ON CONFLICT(uid, birthday_id) DO UPDATE SET message_id = excluded.message_id, date = excluded.date, extra_message_id = excluded.extra_message_id",
-            (uid, bid, message_id, date, extra_message_id),
+            "INSERT INTO last_notifications(uid, birthday_id, message_id, date, extra_message_id, repeat_count) VALUES(?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(uid, birthday_id) DO UPDATE SET message_id = excluded.message_id, date = excluded.date, "
+            "extra_message_id = excluded.extra_message_id, repeat_count = excluded.repeat_count",
+            (uid, bid, message_id, date, extra_message_id, repeat_count),
+        )
+
+    async def set_notification_repeat(self, uid: int, bid: int, repeat_count: int) -> None:
+        # reminder was edited in place: same messages, one more repeat
+        await self.execute(
+            "UPDATE last_notifications SET repeat_count = ? WHERE uid = ? AND birthday_id = ?",
+            (repeat_count, uid, bid),
         )
 
     async def delete_last_notification(self, uid: int, bid: int) -> None:
         await self.execute("DELETE FROM last_notifications WHERE uid = ? AND birthday_id = ?", (uid, bid))
 
-    async def reset_daily_flags(self) -> None:
-        await self.execute("UPDATE birthdays SET already_remaind = 0")
+    # digest mode (user_prefs.digest)
+    async def get_digest_mode(self, uid: int) -> bool:
+        row = await self.fetchone("SELECT digest FROM user_prefs WHERE uid = ?", (uid,))
+        return bool(row and row["digest"])
+
+    async def set_digest_mode(self, uid: int, enabled: bool) -> None:
+        await self.execute(
+            "INSERT INTO user_prefs(uid, digest) VALUES(?, ?) ON CONFLICT(uid) DO UPDATE SET digest = excluded.digest",
+            (uid, int(enabled)),
+        )
+
+    async def get_last_digest(self, uid: int) -> Optional[sqlite3.Row]:
+        return await self.fetchone("SELECT * FROM last_digests WHERE uid = ?", (uid,))
+
+    async def upsert_last_digest(self, uid: int, message_id: int, date: str, birthday_ids: Iterable[int], repeat_count: int) -> None:
+        await self.execute(
+            "INSERT INTO last_digests(uid, message_id, date, birthday_ids, repeat_count) VALUES(?, ?, ?, ?, ?) "
+            "ON CONFLICT(uid) DO UPDATE SET message_id = excluded.message_id, date = excluded.date, "
+            "birthday_ids = excluded.birthday_ids, repeat_count = excluded.repeat_count",
+            (uid, message_id, date, ",".join(str(int(b)) for b in birthday_ids), repeat_count),
+        )
+
+    async def set_digest_birthdays(self, uid: int, birthday_ids: Iterable[int]) -> None:
+        # digest edited after «Уже поздравил»/«Отложить»: same message, fewer lines
+        await self.execute(
+            "UPDATE last_digests SET birthday_ids = ? WHERE uid = ?",
+            (",".join(str(int(b)) for b in birthday_ids), uid),
+        )
+
+    # delivery outbox
+    async def enqueue_outbox(self, items: Iterable[tuple[int, int, str]], slot: dt.datetime) -> int:
+        """Add (uid, birthday_id, local_date) delivery jobs for the tick `slot` (naive UTC).
+        Idempotent: a row already pending/sending is left alone, a finished row is re-armed
+        only by a later slot, so replaying the same tick after a restart sends nothing twice.
+        Returns the number of rows that became pending.
+        """
+        slot_s = slot.strftime("%Y-%m-%d %H:%M:%S")
+        now_s = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        rows = [(uid, bid, local_date, slot_s, now_s, now_s) for uid, bid, local_date in items]
+        if not rows:
+            return 0
+
+        def run(conn: sqlite3.Connection) -> int:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT INTO outbox (uid, birthday_id, local_date, slot, status, attempts, not_before, enqueued_at) "
+                "VALUES (?, ?, ?, ?, 'pending', 0, ?, ?) "
+                "ON CONFLICT(uid, birthday_id, local_date) DO UPDATE SET "
+                " slot = excluded.slot, status = 'pending', attempts = 0, not_before = excluded.not_before,"
+                " enqueued_at = excluded.enqueued_at, last_error = NULL "
+                "WHERE outbox.status NOT IN ('pending', 'sending') AND outbox.slot < excluded.slot",
+                rows,
+            )
+            return conn.total_changes - before
+
+        return await self._write(run, "enqueue_outbox: INSERT INTO outbox ... ON CONFLICT DO UPDATE", explain=False)
+
+    async def claim_outbox(
+        self,
+        now_utc: dt.datetime,
+        limit: int = 200,
+        uids: Iterable[int] | None = None,
+        shard: tuple[int, Iterable[int]] | None = None,
+    ) -> list[sqlite3.Row]:
+        """Take up to `limit` due pending jobs and mark them 'sending', in one transaction.
+        Jobs that became pointless (birthday deleted, moved or congratulated, local day over)
+        are dropped first. Rows carry b.*, outbox_id, local_date, attempts, tz_offset, digest
+        and last_notifications ids — everything the sender needs.
+        uids / shard=(count, ids) restrict the claim to those users / uid partitions.
+        """
+        now_s = now_utc.strftime("%Y-%m-%d %H:%M:%S")
+        params: list[Any] = []
+        scope = ["o.status = 'pending'"]
+        if uids is not None:
+            uids = list(uids)
+            scope.append(f"o.uid IN ({', '.join('?' for _ in uids)})")
+            params += uids
+        if shard is not None:
+            scope.append(_shard_where("o.uid", shard, params))
+        # the drop pass is limited to the same users, so a one-user claim stays O(that user)
+        drop_params = [*params, now_s]
+        where = scope + ["o.not_before <= ?"]
+        params += [now_s, limit]
+
+        def run(conn: sqlite3.Connection) -> list[sqlite3.Row]:
+            conn.execute(
+                "UPDATE outbox SET status = 'dropped' WHERE status = 'pending' AND id IN ("
+                " SELECT o.id FROM outbox o"
+                " LEFT JOIN birthdays b ON b.id = o.birthday_id AND b.uid = o.uid"
+                " LEFT JOIN user_prefs p ON p.uid = o.uid"
+                f" WHERE {' AND '.join(scope)} AND ("
+                "  b.id IS NULL"
+                "  OR b.notified_on IS o.local_date"
+                "  OR o.local_date < date(?, printf('%+d hours', COALESCE(p.tz_offset, 0)))"
+                "  OR NOT (b.mmdd = CAST(strftime('%m%d', o.local_date) AS INTEGER)"
+                "   OR (b.mmdd = 229 AND strftime('%m%d', o.local_date) = '0228' AND strftime('%d', o.local_date, '+1 day') = '01'))))",
+                drop_params,
+            )
+            rows = conn.execute(
+                "SELECT b.*, o.id AS outbox_id, o.local_date, o.attempts,"
+                " COALESCE(p.tz_offset, 0) AS tz_offset,"
+                " COALESCE(p.digest, 0) AS digest,"
+                " n.message_id AS last_message_id,"
+                " n.extra_message_id AS last_extra_message_id,"
+                " n.date AS last_date,"
+                " n.repeat_count AS last_repeat_count"
+                " FROM outbox o"
+                " JOIN birthdays b ON b.id = o.birthday_id AND b.uid = o.uid"
+                " LEFT JOIN user_prefs p ON p.uid = o.uid"
+                " LEFT JOIN last_notifications n ON n.uid = o.uid AND n.birthday_id = o.birthday_id"
+                f" WHERE {' AND '.join(where)}"
+                " ORDER BY o.slot, o.id LIMIT ?",
+                params,
+            ).fetchall()
+            if rows:
+                ids = [int(r["outbox_id"]) for r in rows]
+                conn.execute(
+                    f"UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id IN ({', '.join('?' for _ in ids)})",
+                    [now_s, *ids],
+                )
+            return rows
+
+        return await self._write(run, "claim_outbox: UPDATE outbox SET status = 'sending' ...", explain=False)
+
+    async def mark_outbox_sent(self, outbox_id: int) -> None:
+        await self.execute(
+            "UPDATE outbox SET status = 'sent', sent_at = datetime('now'), last_error = NULL WHERE id = ?",
+            (outbox_id,),
+        )
+
+    async def mark_outbox_failed(self, outbox_id: int, error: str, retry_at: dt.datetime | None) -> None:
+        # retry_at=None: give up until the next tick re-arms the row
+        if retry_at is None:
+            await self.execute(
+                "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                (error[:500], outbox_id),
+            )
+        else:
+            await self.execute(
+                "UPDATE outbox SET status = 'pending', attempts = attempts + 1, last_error = ?, not_before = ? WHERE id = ?",
+                (error[:500], retry_at.strftime("%Y-%m-%d %H:%M:%S"), outbox_id),
+            )
+
+    async def requeue_inflight_outbox(
+        self, claimed_before: dt.datetime | None = None, shard: tuple[int, Iterable[int]] | None = None
+    ) -> int:
+        """Jobs stuck in 'sending' (their sender died) go back to pending. claimed_before: only
+        jobs claimed earlier than that, so that a live sender's jobs are left alone;
+        shard=(count, ids): only those uid partitions."""
+        where = ["status = 'sending'"]
+        params: list[Any] = []
+        if claimed_before is not None:
+            where.append("(claimed_at IS NULL OR claimed_at < ?)")
+            params.append(claimed_before.strftime("%Y-%m-%d %H:%M:%S"))
+        if shard is not None:
+            where.append(_shard_where("uid", shard, params))
+        query = f"UPDATE outbox SET status = 'pending' WHERE {' AND '.join(where)}"
+
+        def run(conn: sqlite3.Connection) -> int:
+            return conn.execute(query, params).rowcount
+
+        return await self._write(run, query, tuple(params))
+
+    async def outbox_depth(self) -> dict[str, int]:
+        rows = await self.fetchall("SELECT status, COUNT(*) AS c FROM outbox GROUP BY status")
+        return {r["status"]: int(r["c"]) for r in rows}
+
+    async def count_outbox_in_flight(self, uid: int, local_date: str, birthday_ids: Iterable[int]) -> int:
+        """How many of the given jobs of `uid` for `local_date` are still pending or sending."""
+        ids = list(birthday_ids)
+        if not ids:
+            return 0
+        row = await self.fetchone(
+            "SELECT COUNT(*) AS c FROM outbox WHERE uid = ? AND local_date = ? "
+            f"AND birthday_id IN ({','.join('?' * len(ids))}) AND status IN ('pending', 'sending')",
+            (uid, local_date, *ids),
+        )
+        return int(row["c"]) if row else 0
+
+    async def prune_outbox(self, before_local_date: str) -> None:
+        await self.execute(
+            "DELETE FROM outbox WHERE local_date < ? AND status NOT IN ('pending', 'sending')",
+            (before_local_date,),
+        )
+
+    # sharded reminder workers
+    async def acquire_lease(self, shard: int, owner: str, ttl: float, home: bool) -> bool:
+        """Take or renew the lease of a uid partition. Succeeds for the current owner, when
+        the lease has expired, or when the home worker reclaims it from a stand-in."""
+        now = time.time()
+
+        def run(conn: sqlite3.Connection) -> bool:
+            cur = conn.execute(
+                "INSERT INTO reminder_leases (shard, owner, home, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(shard) DO UPDATE SET owner = excluded.owner, home = excluded.home, expires_at = excluded.expires_at "
+                "WHERE reminder_leases.owner = excluded.owner OR reminder_leases.expires_at < ? "
+                " OR (excluded.home = 1 AND reminder_leases.home = 0)",
+                (shard, owner, int(home), now + ttl, now),
+            )
+            return cur.rowcount > 0
+
+        return await self._write(run, "acquire_lease: INSERT INTO reminder_leases ... ON CONFLICT DO UPDATE", explain=False)
+
+    async def release_leases(self, owner: str) -> None:
+        await self.execute("DELETE FROM reminder_leases WHERE owner = ?", (owner,))
+
+    async def list_leases(self) -> list[sqlite3.Row]:
+        return await self.fetchall("SELECT shard, owner, home, expires_at FROM reminder_leases ORDER BY shard")
+
+    async def last_change_seq(self) -> int:
+        row = await self.fetchone("SELECT COALESCE(MAX(seq), 0) AS seq FROM change_log")
+        return int(row["seq"]) if row else 0
+
+    async def changes_since(self, seq: int, limit: int = 10_000) -> list[sqlite3.Row]:
+        """(seq, uid) of users whose birthdays or prefs changed after seq, any process."""
+        return await self.fetchall("SELECT seq, uid FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit))
+
+    # FSM storage (db/fsm.py)
+    async def fsm_get(self, key: str) -> Optional[sqlite3.Row]:
+        return await self.fetchone("SELECT state, data, updated_at FROM fsm_state WHERE key = ?", (key,))
+
+    async def fsm_put_many(self, rows: Iterable[tuple[str, Optional[str], str, float]]) -> None:
+        """Write (key, state, data_json, updated_at) rows in one transaction; a row without
+        state and with empty data is the finished dialog and is deleted."""
+        rows = list(rows)
+        if not rows:
+            return
+        keep = [r for r in rows if r[1] is not None or r[2] != "{}"]
+        gone = [(r[0],) for r in rows if r[1] is None and r[2] == "{}"]
+
+        def run(conn: sqlite3.Connection) -> int:
+            if keep:
+                conn.executemany(
+                    "INSERT INTO fsm_state(key, state, data, updated_at) VALUES(?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+                    keep,
+                )
+            if gone:
+                conn.executemany("DELETE FROM fsm_state WHERE key = ?", gone)
+            return len(rows)
+
+        await self._write(run, "fsm_put_many: INSERT INTO fsm_state ... ON CONFLICT DO UPDATE", explain=False)
+
+    async def fsm_purge(self, before: float) -> int:
+        def run(conn: sqlite3.Connection) -> int:
+            return conn.execute("DELETE FROM fsm_state WHERE updated_at < ?", (before,)).rowcount
+
+        return await self._write(run, "DELETE FROM fsm_state WHERE updated_at < ?", (before,))
 
     # user preferences
-    async def get_user_prefs(self, uid: int) -> Optional[sqlite3.Row]:
-        return await self.fetchone("SELECT * FROM user_prefs WHERE uid = ?", (uid,))
+    async def get_prefs(self, uid: int) -> tuple[int, int]:
+        """(tz_offset, start_hour) of the user, defaults if not set; served from prefs_cache."""
+        cached = self.prefs_cache.get(uid)
+        if cached is not None:
+            return cached
+        version = self.prefs_cache.version
+        row = await self.fetchone("SELECT tz_offset, start_hour FROM user_prefs WHERE uid = ?", (uid,))
+        prefs = (int(row["tz_offset"]), int(row["start_hour"])) if row else DEFAULT_PREFS
+        self.prefs_cache.put(uid, *prefs, version=version)
+        return prefs
+
+    async def warm_prefs_cache(self) -> None:
+        if not self.prefs_cache.max_entries:
+            return
+        version = self.prefs_cache.version
+        rows = await self.fetchall(
+            "SELECT uid, tz_offset, start_hour FROM user_prefs LIMIT ?",
+            (self.prefs_cache.max_entries,),
+        )
+        for r in rows:
+            self.prefs_cache.put(int(r["uid"]), int(r["tz_offset"]), int(r["start_hour"]), version=version)
 
     async def upsert_user_prefs(self, uid: int, tz_offset: int, start_hour: int) -> None:
         await self.execute(
@@ -188,10 +1066,9 @@ class Database:
             "ON CONFLICT(uid) DO UPDATE SET tz_offset = excluded.tz_offset, start_hour = excluded.start_hour",
             (uid, tz_offset, start_hour),
         )
-
-    async def list_uids_with_birthdays(self) -> list[int]:
-        rows = await self.fetchall("SELECT DISTINCT uid FROM birthdays")
-        return [int(r["uid"]) for r in rows]
+        # write-through: the cache never serves stale prefs
+        self.prefs_cache.put(uid, tz_offset, start_hour)
+        self._changed(uid)
 
     async def count_unique_users(self) -> int:
         row = await self.fetchone("SELECT COUNT(DISTINCT uid) AS c FROM birthdays")
@@ -210,9 +1087,9 @@ class Database:
 _db: Database | None = None
 
 
-def init_database(path: str) -> Database:
+def init_database(path: str, **options: Any) -> Database:
     global _db
-    _db = Database(path)
+    _db = Database(path, **options)
     return _db
 
 
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from db.db import Database
+
+
+# Примерный «вес» записи кэша сверх ключа и данных: объект списка, строки, место в OrderedDict
+ENTRY_OVERHEAD = 200
+# Как часто выбрасывать брошенные диалоги (в памяти и в базе), с
+PURGE_EVERY_S = 600.0
+
+
+class SQLiteStorage(BaseStorage):
+    """aiogram FSM storage in the bot's SQLite file (table fsm_state), so unfinished
+    dialogs survive a restart.
+
+    Recently used keys live in an LRU cache bounded by `max_bytes` (keys + JSON data).
+    Writes only touch the cache and are flushed in one transaction every `flush_interval`
+    seconds (write-behind). An evicted entry that is not flushed yet is written out right
+    away. Dialogs nobody has written to for `ttl` seconds count as finished: they read as
+    empty and are purged. max_bytes=0 disables the cache: every call goes to the database,
+    which is what several bot processes sharing one database need.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        ttl: float = 24 * 3600,
+        max_bytes: int = 8 * 1024 * 1024,
+        flush_interval: float = 1.0,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        self.db = db
+        self.ttl = max(60.0, ttl)
+        self.max_bytes = max(0, max_bytes)
+        self.flush_interval = max(0.05, flush_interval)
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        # key -> [state, data_json, updated_at]; users without a dialog are cached too
+        # (state None, data "{}"), otherwise every state filter check would hit the database
+        self._cache: OrderedDict[str, list] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._bytes = 0
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # BaseStorage
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._put(self.key_builder.build(key), state=value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(self.key_builder.build(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict, not {type(data).__name__}")
+        await self._put(self.key_builder.build(key), data=json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return json.loads((await self._get(self.key_builder.build(key)))[1])
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    # cache
+    async def _get(self, key: str) -> tuple[Optional[str], str]:
+        now = time.time()
+        entry = self._cache.get(key) if self.max_bytes else None
+        if entry is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        else:
+            self.misses += 1
+            row = await self.db.fsm_get(key)
+            entry = self._cache.get(key) if self.max_bytes else None
+            if entry is None:
+                # nobody wrote this key while we were reading it
+                entry = [row["state"], row["data"], float(row["updated_at"])] if row else [None, "{}", now]
+                if self.max_bytes:
+                    self._store(key, entry)
+                    await self._evict()
+        if entry[0] is not None or entry[1] != "{}":
+            if now - entry[2] > self.ttl:
+                return None, "{}"
+        return entry[0], entry[1]
+
+    async def _put(self, key: str, **fields: Any) -> None:
+        state, data = await self._get(key)
+        entry = [fields.get("state", state), fields.get("data", data), time.time()]
+        if not self.max_bytes:
+            await self.db.fsm_put_many([(key, *entry)])
+            return
+        self._store(key, entry)
+        self._dirty.add(key)
+        await self._evict()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def _store(self, key: str, entry: list) -> None:
+        old = self._cache.get(key)
+        if old is not None:
+            self._bytes -= self._size(key, old)
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        self._bytes += self._size(key, entry)
+
+    @staticmethod
+    def _size(key: str, entry: list) -> int:
+        return len(key) + len(entry[0] or "") + len(entry[1]) + ENTRY_OVERHEAD
+
+    async def _evict(self) -> None:
+        # the hard cap holds even for a single huge dialog: it goes straight to the database
+        spill = []
+        while self._bytes > self.max_bytes and self._cache:
+            key, entry = self._cache.popitem(last=False)
+            self._bytes -= self._size(key, entry)
+            self.evictions += 1
+            if key in self._dirty:
+                self._dirty.discard(key)
+                spill.append((key, *entry))
+        if spill:
+            await self.db.fsm_put_many(spill)
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        rows = [(key, *self._cache[key]) for key in keys if key in self._cache]
+        try:
+            await self.db.fsm_put_many(rows)
+        except Exception:
+            # не теряем: запишем со следующим сбросом
+            self._dirty.update(key for key in keys if key in self._cache)
+            raise
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self._last_purge >= PURGE_EVERY_S:
+                    await self.purge()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("FSM: не удалось сохранить состояния диалогов")
+
+    async def purge(self) -> int:
+        """Forget dialogs older than ttl, in memory and in the database."""
+        now = time.time()
+        self._last_purge = now
+        cutoff = now - self.ttl
+        for key in [k for k, e in self._cache.items() if e[2] < cutoff and k not in self._dirty]:
+            self._bytes -= self._size(key, self._cache.pop(key))
+        removed = await self.db.fsm_purge(cutoff)
+        if removed:
+            logging.info(f"FSM: удалено {removed} брошенных диалогов")
+        return removed
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._cache),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
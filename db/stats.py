@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+from dataclasses import dataclass, field
+
+
+# Upper bounds of latency histogram buckets, ms (the last one catches everything else)
+BUCKETS_MS: tuple[float, ...] = (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf"))
+
+# Не даём словарю расти бесконечно, если где-то SQL собирается из данных
+MAX_STATEMENTS = 500
+
+_WS_RE = re.compile(r"\s+")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w?])-?\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace, literals and `IN (?, ?, ...)` lists so that one statement
+    shape maps to one stats entry."""
+    s = _WS_RE.sub(" ", sql).strip()
+    s = _STRING_RE.sub("?", s)
+    s = _NUMBER_RE.sub("?", s)
+    s = _IN_LIST_RE.sub("(?...)", s)
+    return s
+
+
+@dataclass
+class StatementStats:
+    sql: str
+    calls: int = 0
+    rows: int = 0            # rows returned (reads) or affected (writes)
+    errors: int = 0
+    total_ms: float = 0.0    # queue + exec
+    queue_ms: float = 0.0    # waiting for the thread pool / reader connection / writer batch
+    exec_ms: float = 0.0     # inside SQLite
+    max_ms: float = 0.0
+    buckets: list[int] = field(default_factory=lambda: [0] * len(BUCKETS_MS))
+
+    @property
+    def id(self) -> str:
+        # stable short key of the full normalized SQL: truncated texts of two statements may match
+        return hashlib.sha1(self.sql.encode()).hexdigest()[:10]
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.calls if self.calls else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the histogram bucket holding the q-th quantile (0 < q <= 1)."""
+        if not self.calls:
+            return 0.0
+        need = q * self.calls
+        acc = 0
+        for bound, n in zip(BUCKETS_MS, self.buckets):
+            acc += n
+            if acc >= need:
+                return bound if bound != float("inf") else self.max_ms
+        return self.max_ms
+
+
+class QueryStats:
+    """Per-statement latency histograms; safe to update from the DB threads."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stmts: dict[str, StatementStats] = {}
+
+    def record(self, sql: str, queue_s: float, exec_s: float, rows: int = 0, error: bool = False) -> None:
+        key = normalize_sql(sql)
+        queue_ms = queue_s * 1000
+        exec_ms = exec_s * 1000
+        total = queue_ms + exec_ms
+        with self._lock:
+            st = self._stmts.get(key)
+            if st is None:
+                if len(self._stmts) >= MAX_STATEMENTS:
+                    key = "<other>"
+                    st = self._stmts.get(key)
+                if st is None:
+                    st = self._stmts[key] = StatementStats(sql=key)
+            st.calls += 1
+            st.rows += rows
+            st.errors += int(error)
+            st.total_ms += total
+            st.queue_ms += queue_ms
+            st.exec_ms += exec_ms
+            st.max_ms = max(st.max_ms, total)
+            for i, bound in enumerate(BUCKETS_MS):
+                if total <= bound:
+                    st.buckets[i] += 1
+                    break
+
+    def snapshot(self) -> list[StatementStats]:
+        """Copies of all entries, most expensive (by total time) first."""
+        with self._lock:
+            items = [
+                StatementStats(
+                    sql=s.sql,
+                    calls=s.calls,
+                    rows=s.rows,
+                    errors=s.errors,
+                    total_ms=s.total_ms,
+                    queue_ms=s.queue_ms,
+                    exec_ms=s.exec_ms,
+                    max_ms=s.max_ms,
+                    buckets=list(s.buckets),
+                )
+                for s in self._stmts.values()
+            ]
+        items.sort(key=lambda s: s.total_ms, reverse=True)
+        return items
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stmts.clear()
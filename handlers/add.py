@@ -57,13 +57,19 @@ async def add_phone(message: Message, state: FSMContext):
 
     uid = message.from_user.id
     db = get_db()
-    _id = await db.add_birthday(
+    _id, created = await db.add_birthday(
         uid=uid,
         date=data["date"],
         friend=data["friend"],
         phone=data.get("phone"),
     )
     from services.utils import human_date_short
+    if not created:
+        await message.answer(
+            f"Запись с таким именем и датой уже есть: {data['friend']} — {human_date_short(data['date'])}",
+            reply_markup=main_keyboard(message.from_user.id),
+        )
+        return
     await message.answer(
         f"Добавлено: {data['friend']} — {human_date_short(data['date'])}",
         reply_markup=main_keyboard(message.from_user.id),
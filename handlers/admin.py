@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from aiogram import Router, F
+from aiogram import Router, F, html
 from aiogram.types import Message
 
 from db.db import get_db
@@ -36,3 +36,33 @@ async def users_stats(message: Message):
     lines.append("")
     lines.append(f"Уникальных пользователей: {total_users}; Всего записей: {total_records}")
     await message.answer("\n".join(lines) or "Нет данных")
+
+
+@router.message(F.text == "/dbstats")
+async def db_stats(message: Message):
+    uid = message.from_user.id
+    if not await _is_admin(uid):
+        return
+    db = get_db()
+    stats = db.stats.snapshot()
+    pc = db.prefs_cache.stats()
+    outbox = await db.outbox_depth()
+    lines = [
+        f"Кэш настроек: {pc['size']}/{pc['max_entries']}, попаданий {pc['hits']}, промахов {pc['misses']}, вытеснено {pc['evictions']}",
+        "Outbox: " + ", ".join(f"{status} {n}" for status, n in sorted(outbox.items())) if outbox else "Outbox: пусто",
+        "",
+        "Запросы к БД (топ-10 по суммарному времени):",
+    ]
+    for st in stats[:10]:
+        lines.append(
+            f"\n{html.quote(st.sql[:200])}\n"
+            f"вызовов {st.calls}, строк {st.rows}, ошибок {st.errors}; "
+            f"avg {st.avg_ms:.1f} мс, p95 ≤{st.percentile(0.95):g} мс, max {st.max_ms:.1f} мс; "
+            f"очередь {st.queue_ms:.0f} мс / SQLite {st.exec_ms:.0f} мс"
+        )
+    # режем по целым записям: обрезок посреди HTML-сущности Telegram не примет
+    text = "\n".join(lines)
+    while len(text) > 4000 and len(lines) > 1:
+        lines.pop()
+        text = "\n".join(lines)
+    await message.answer(text)
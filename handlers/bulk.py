@@ -1,20 +1,38 @@
 from __future__ import annotations
 
-from io import BytesIO
-from typing import List, Tuple
-
-from aiogram import Router, F
+import asyncio
+import codecs
+import logging
+import time
+from typing import AsyncIterator, List, Tuple
+
+from aiogram import Bot, Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import Document, Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 
-from db.db import get_db
-from services.utils import parse_bulk_text
+from db.db import BulkResult, get_db
+from services.utils import BulkParser, parse_bulk_text
 
 
 router = Router()
 
 
+# Строк в одной транзакции импорта из файла
+BULK_BATCH = 1000
+# Не чаще одного редактирования сообщения о ходе импорта, с
+PROGRESS_EVERY_S = 2.0
+CHUNK_SIZE = 64 * 1024
+# Облачный Bot API не отдаёт ботам файлы больше 20 МБ (локальный сервер Bot API — до 2 ГБ)
+CLOUD_FILE_LIMIT = 20 * 1024 * 1024
+# На весь файл: чтение идёт вперемешку с записью в базу
+DOWNLOAD_TIMEOUT = 1800
+
+# uid -> флаг «Остановить» идущего импорта; заодно не даёт запустить второй параллельно
+_running: dict[int, asyncio.Event] = {}
+
+
 class BulkStates(StatesGroup):
     waiting_input = State()
     confirm = State()
@@ -39,14 +57,24 @@ async def bulk_start(message: Message, state: FSMContext):
 
 @router.message(BulkStates.waiting_input, F.document)
 async def bulk_file(message: Message, state: FSMContext):
-    # Ограничим размер до ~2 МБ
-    if message.document.file_size and message.document.file_size > 2 * 1024 * 1024:
-        await message.answer("Файл слишком большой (>2MB). Разбейте на части.")
+    """Import a file while it downloads: chunks are decoded and parsed as they arrive and
+    committed every BULK_BATCH rows, so memory does not grow with the file. There is no
+    confirmation step (it would need a second pass over the file); instead one message
+    shows the progress and has a stop button."""
+    uid = message.from_user.id
+    doc = message.document
+    if doc.file_size and doc.file_size > CLOUD_FILE_LIMIT and not message.bot.session.api.is_local:
+        await message.answer("Файл больше 20 МБ: Telegram не отдаёт такие ботам. Разбейте его на части.")
+        return
+    if uid in _running:
+        await message.answer("Предыдущий импорт ещё идёт.")
         return
-    buf = BytesIO()
-    await message.bot.download(message.document, destination=buf)
-    text = buf.getvalue().decode("utf-8", errors="ignore")
-    await _process_bulk_text(message, state, text)
+    stop = _running[uid] = asyncio.Event()
+    await state.clear()
+    try:
+        await _import_document(message, doc, stop)
+    finally:
+        _running.pop(uid, None)
 
 
 @router.message(BulkStates.waiting_input, F.text)
@@ -72,6 +100,121 @@ async def _process_bulk_text(message: Message, state: FSMContext, text: str):
     await message.answer(f"Распознано записей: {ok}. Ошибок: {bad}.{preview_err}", reply_markup=kb)
 
 
+async def _document_chunks(bot: Bot, doc: Document) -> AsyncIterator[bytes]:
+    file = await bot.get_file(doc.file_id)
+    api = bot.session.api
+    if api.is_local:
+        with open(api.wrap_local_file.to_local(file.file_path), "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+                yield chunk
+        return
+    async for chunk in bot.session.stream_content(
+        url=api.file_url(bot.token, file.file_path), timeout=DOWNLOAD_TIMEOUT, chunk_size=CHUNK_SIZE
+    ):
+        yield chunk
+
+
+async def _import_document(message: Message, doc: Document, stop: asyncio.Event) -> None:
+    uid = message.from_user.id
+    db = get_db()
+    parser = BulkParser()
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="ignore")
+    total = BulkResult()
+    batch: list[dict] = []
+    errors: list[str] = []
+    bad = 0
+    read = 0
+    tail = ""
+
+    async def commit() -> None:
+        res = await db.bulk_add_birthdays(uid, batch)
+        total.added += res.added
+        total.skipped += res.skipped
+        total.errors += res.errors
+        batch.clear()
+
+    def collect(rows) -> None:
+        nonlocal bad
+        for item, error in rows:
+            if item is not None:
+                batch.append(item)
+            else:
+                bad += 1
+                if len(errors) < 5:
+                    errors.append(error)
+
+    stop_kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Остановить", callback_data="bulk_stop")]])
+    progress = await message.answer("Импорт: читаю файл…", reply_markup=stop_kb)
+    shown = time.monotonic()
+    failed = stopped = False
+    try:
+        async for chunk in _document_chunks(message.bot, doc):
+            read += len(chunk)
+            # строка может оборваться на границе куска — хвост ждёт следующего
+            lines = (tail + decoder.decode(chunk)).split("\n")
+            tail = lines.pop()
+            collect(parser.feed(ln.rstrip("\r") for ln in lines))
+            while len(batch) >= BULK_BATCH:
+                await commit()
+            if stop.is_set():
+                stopped = True
+                break
+            if time.monotonic() - shown >= PROGRESS_EVERY_S:
+                shown = time.monotonic()
+                progress = await _edit(progress, _progress_text(total, bad, read, doc.file_size), stop_kb)
+        else:
+            tail += decoder.decode(b"", final=True)
+            collect(parser.feed([tail] if tail else []))
+            collect(parser.close())
+            if batch:
+                await commit()
+    except Exception:
+        logging.exception(f"Импорт файла: uid={uid}")
+        failed = True
+
+    if failed:
+        text = "Импорт прерван из-за ошибки."
+    elif stopped:
+        text = "Импорт остановлен."
+    else:
+        text = "Импорт завершён."
+    text += f" Добавлено: {total.added}. Пропущено как дубликаты: {total.skipped}."
+    if bad or total.errors:
+        text += f" Ошибочных строк: {bad + total.errors}."
+    if failed or stopped:
+        text += " Уже добавленные записи сохранены; файл можно отправить заново — повторы будут пропущены."
+    if errors:
+        text += "\n\nОшибки (первые 5):\n" + "\n".join(errors)
+    await _edit(progress, text)
+
+
+def _progress_text(total: BulkResult, bad: int, read: int, size: int | None) -> str:
+    done = f"{read / 2**20:.1f} МБ"
+    if size:
+        done += f" из {size / 2**20:.1f} МБ ({min(100, read * 100 // size)}%)"
+    return f"Импорт: прочитано {done}.\nДобавлено: {total.added}, дубликатов: {total.skipped}, ошибок: {bad + total.errors}."
+
+
+async def _edit(message: Message, text: str, reply_markup: InlineKeyboardMarkup | None = None) -> Message:
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            # сообщение удалено — продолжаем в новом
+            return await message.answer(text, reply_markup=reply_markup)
+    return message
+
+
+@router.callback_query(F.data == "bulk_stop")
+async def bulk_stop(call: CallbackQuery):
+    stop = _running.get(call.from_user.id)
+    if stop is None:
+        await call.answer("Импорт уже закончился")
+        return
+    stop.set()
+    await call.answer("Останавливаю…")
+
+
 @router.callback_query(BulkStates.confirm, F.data == "bulk_cancel")
 async def bulk_cancel(call: CallbackQuery, state: FSMContext):
     await state.clear()
@@ -89,19 +232,10 @@ async def bulk_import(call: CallbackQuery, state: FSMContext):
     await state.clear()
     uid = call.from_user.id
     db = get_db()
-    ok = 0
-    skipped = 0
-    for it in items:
-        try:
-            # проверка дубликатов по (friend, date)
-            exists = await db.find_birthday_by_friend_date(uid, it["friend"].strip(), it["date"])
-            if exists:
-                skipped += 1
-            else:
-                await db.add_birthday(uid=uid, date=it["date"], friend=it["friend"].strip(), phone=it.get("phone"), tg_nic=it.get("tg_nic"))
-                ok += 1
-        except Exception:
-            # пропускаем ошибочные
-            continue
-    await call.message.edit_text(f"Импорт завершён. Добавлено: {ok} из {len(items)}. Пропущено как дубликаты: {skipped}.")
+    # одна транзакция: staging-таблица + ON CONFLICT по (uid, friend, date)
+    res = await db.bulk_add_birthdays(uid, items)
+    text = f"Импорт завершён. Добавлено: {res.added} из {len(items)}. Пропущено как дубликаты: {res.skipped}."
+    if res.errors:
+        text += f" Ошибочных строк: {res.errors}."
+    await call.message.edit_text(text)
     await call.answer()
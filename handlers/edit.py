@@ -77,7 +77,9 @@ async def edit_apply(message: Message, state: FSMContext):
         value = value_raw if value_raw else None
 
     db = get_db()
-    await db.update_birthday_field(message.from_user.id, bid, field, value)
+    if not await db.update_birthday_field(message.from_user.id, bid, field, value):
+        await message.answer("Запись с таким именем и датой уже есть.")
+        return
     await state.clear()
     await message.answer("Сохранено.")
 
@@ -7,6 +7,7 @@ from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKe
 from aiogram.exceptions import TelegramBadRequest
 
 from db.db import get_db
+from services.cleanup import get_cleaner
 
 
 router = Router()
@@ -150,29 +151,15 @@ async def link_done(call: CallbackQuery, state: FSMContext):
     control_mid = data.get("control_mid")
     user_mids = data.get("user_mids", []) or []
     control_mids = data.get("control_mids", []) or []
-    try:
-        if control_mid:
-            await call.bot.delete_message(chat_id=call.from_user.id, message_id=int(control_mid))
-    except TelegramBadRequest:
-        pass
-    try:
-        # Удалим и текущее, если это другое сообщение
-        if call.message and (not control_mid or call.message.message_id != int(control_mid)):
-            await call.message.delete()
-    except TelegramBadRequest:
-        pass
-    # Try to delete user's forwarded/contact messages for cleanliness
-    for mid in user_mids:
-        try:
-            await call.bot.delete_message(chat_id=call.from_user.id, message_id=int(mid))
-        except TelegramBadRequest:
-            pass
-    # Try delete all tracked control messages
-    for mid in control_mids:
-        try:
-            await call.bot.delete_message(chat_id=call.from_user.id, message_id=int(mid))
-        except TelegramBadRequest:
-            pass
+    # Удалим контрольное и текущее сообщения, пересланные/контакты пользователя и все
+    # отслеживаемые контрольные сообщения — одним фоновым deleteMessages
+    get_cleaner().delete(
+        call.from_user.id,
+        control_mid,
+        call.message.message_id if call.message else None,
+        *user_mids,
+        *control_mids,
+    )
     await state.clear()
     await call.answer()
 
@@ -183,25 +170,12 @@ async def link_cancel(call: CallbackQuery, state: FSMContext):
     control_mid = data.get("control_mid")
     user_mids = data.get("user_mids", []) or []
     control_mids = data.get("control_mids", []) or []
-    try:
-        if control_mid:
-            await call.bot.delete_message(chat_id=call.from_user.id, message_id=int(control_mid))
-    except TelegramBadRequest:
-        pass
-    try:
-        if call.message and (not control_mid or call.message.message_id != int(control_mid)):
-            await call.message.delete()
-    except TelegramBadRequest:
-        pass
-    for mid in user_mids:
-        try:
-            await call.bot.delete_message(chat_id=call.from_user.id, message_id=int(mid))
-        except TelegramBadRequest:
-            pass
-    for mid in control_mids:
-        try:
-            await call.bot.delete_message(chat_id=call.from_user.id, message_id=int(mid))
-        except TelegramBadRequest:
-            pass
+    get_cleaner().delete(
+        call.from_user.id,
+        control_mid,
+        call.message.message_id if call.message else None,
+        *user_mids,
+        *control_mids,
+    )
     await state.clear()
     await call.answer()
@@ -1,12 +1,15 @@
 from __future__ import annotations
 
+from bisect import bisect_left, bisect_right
 from math import ceil
 
 from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 
+from db.cache import ListItem
 from db.db import get_db
-from services.utils import human_date_short, days_until_next
+from services.utils import human_date_short, local_now
 
 
 router = Router()
@@ -15,41 +18,94 @@ router = Router()
 PAGE_SIZE = 5
 
 
-def list_keyboard(items: list, page: int, total_pages: int) -> InlineKeyboardMarkup:
+def _cursor(item: ListItem) -> str:
+    return f"{item.mmdd}:{item.id}"
+
+
+def list_keyboard(items: list[ListItem], page: int, total_pages: int) -> InlineKeyboardMarkup:
     rows = []
     for r in items:
-        bid = int(r["id"]) 
-        title = f"{r['friend']} — {human_date_short(r['date'])}"
-        rows.append([InlineKeyboardButton(text=title, callback_data=f"edit:{bid}")])
+        title = f"{r.friend} — {human_date_short(r.date)}"
+        rows.append([InlineKeyboardButton(text=title, callback_data=f"edit:{r.id}")])
+    # keyset-курсоры: «назад» — до первой строки страницы, «вперёд» — после последней
     nav = []
-    if page > 1:
-        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"page:{page-1}"))
-    if page < total_pages:
-        nav.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"page:{page+1}"))
+    if page > 1 and items:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"page:{page-1}:p:{_cursor(items[0])}"))
+    if page < total_pages and items:
+        nav.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"page:{page+1}:n:{_cursor(items[-1])}"))
     if nav:
         rows.append(nav)
     return InlineKeyboardMarkup(inline_keyboard=rows or [[]])
 
 
-async def render_list(message: Message, page: int, uid: int):
+def _page_of(
+    items: list[ListItem], today_mmdd: int, cursor: tuple[int, int] | None, backward: bool
+) -> list[ListItem]:
+    # тот же порядок и те же курсоры, что у list_birthdays_keyset, но по готовому списку в памяти
+    def key(it: ListItem) -> tuple[bool, int, int]:
+        return (it.mmdd < today_mmdd, it.mmdd, it.id)
+
+    if not backward:
+        start = 0 if cursor is None else bisect_right(items, (cursor[0] < today_mmdd, *cursor), key=key)
+        return items[start:start + PAGE_SIZE]
+    end = len(items) if cursor is None else bisect_left(items, (cursor[0] < today_mmdd, *cursor), key=key)
+    return items[max(0, end - PAGE_SIZE):end]
+
+
+async def _show(message: Message, text: str, edit: bool, reply_markup: InlineKeyboardMarkup | None = None) -> None:
+    if edit:
+        try:
+            await message.edit_text(text, reply_markup=reply_markup)
+            return
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return
+            # сообщение удалено или недоступно — пришлём новое
+    await message.answer(text, reply_markup=reply_markup)
+
+
+async def render_list(
+    message: Message,
+    page: int,
+    uid: int,
+    cursor: tuple[int, int] | None = None,
+    backward: bool = False,
+    edit: bool = False,
+):
     db = get_db()
-    rows_all = await db.list_birthdays_all(uid)
-    if not rows_all:
-        await message.answer("Список пуст. Добавьте первую запись командой /add или кнопкой.")
+    # сортировка «скоро → позже» относительно локальной даты пользователя
+    tz_offset, _ = await db.get_prefs(uid)
+    today = local_now(tz_offset)
+    today_mmdd = today.month * 100 + today.day
+    # упорядоченный список кэшируется до первой записи пользователя: листание идёт без запросов
+    items = await db.list_birthdays_sorted(uid, today.strftime("%Y-%m-%d"))
+    if items is not None:
+        total = len(items)
+        rows = _page_of(items, today_mmdd, cursor, backward)
+        if not rows and total:
+            page = 1
+            rows = items[:PAGE_SIZE]
+    else:
+        # очень длинный список — не держим его в памяти, читаем страницу keyset-запросом
+        total = await db.count_birthdays(uid)
+        found = await db.list_birthdays_keyset(uid, today_mmdd, cursor, backward=backward, limit=PAGE_SIZE)
+        if not found:
+            # курсор устарел (записи удалены) — начинаем сначала
+            page = 1
+            found = await db.list_birthdays_keyset(uid, today_mmdd, limit=PAGE_SIZE)
+        rows = [ListItem(int(r["id"]), r["friend"], r["date"], int(r["mmdd"])) for r in found]
+    if not total:
+        await _show(message, "Список пуст. Добавьте первую запись командой /add или кнопкой.", edit)
         return
-    # sort by days until next birthday ascending
-    rows_all_sorted = sorted(rows_all, key=lambda r: days_until_next(r['date']))
-    total = len(rows_all_sorted)
     total_pages = max(1, ceil(total / PAGE_SIZE))
     page = max(1, min(page, total_pages))
     offset = (page - 1) * PAGE_SIZE
-    rows = rows_all_sorted[offset: offset + PAGE_SIZE]
 
     lines = []
     for i, r in enumerate(rows, start=1 + offset):
-        lines.append(f"{i}. {r['friend']} — {human_date_short(r['date'])}")
+        lines.append(f"{i}. {r.friend} — {human_date_short(r.date)}")
     text = "\n".join(lines) + f"\n\nСтр. {page}/{total_pages}"
-    await message.answer(text, reply_markup=list_keyboard(rows, page, total_pages))
+    await _show(message, text, edit, list_keyboard(rows, page, total_pages))
 
 
 @router.message(F.text == "/list")
@@ -60,7 +116,16 @@ async def list_command(message: Message):
 
 @router.callback_query(F.data.startswith("page:"))
 async def list_page(call: CallbackQuery):
-    page = int(call.data.split(":", 1)[1])
-    await call.message.delete()
-    await render_list(call.message, page, uid=call.from_user.id)
+    # page:<n>:<n|p>:<mmdd>:<id>; старые кнопки вида page:<n> открывают начало списка
+    parts = call.data.split(":")
+    page = int(parts[1])
+    cursor = None
+    backward = False
+    if len(parts) == 5:
+        backward = parts[2] == "p"
+        cursor = (int(parts[3]), int(parts[4]))
+    else:
+        page = 1
+    # та же страница правится на месте: один вызов API вместо удаления и новой отправки
+    await render_list(call.message, page, uid=call.from_user.id, cursor=cursor, backward=backward, edit=True)
     await call.answer()
@@ -4,7 +4,7 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
 
 from db.db import get_db
-from services.reminder_service import ReminderService
+from services.reminder_service import ReminderService, TodayReport
 
 
 router = Router()
@@ -23,7 +23,7 @@ def bind_reminder_service(service: ReminderService):
 async def cb_done(call: CallbackQuery):
     bid = int(call.data.split(":", 1)[1])
     if reminder_service:
-        await reminder_service.handle_done(call.from_user.id, bid)
+        await reminder_service.handle_done(call.from_user.id, bid, call.message.message_id if call.message else None)
     await call.answer()
 
 
@@ -31,7 +31,7 @@ async def cb_done(call: CallbackQuery):
 async def cb_snooze(call: CallbackQuery):
     bid = int(call.data.split(":", 1)[1])
     if reminder_service:
-        await reminder_service.handle_snooze(call.from_user.id, bid)
+        await reminder_service.handle_snooze(call.from_user.id, bid, call.message.message_id if call.message else None)
     await call.answer()
 
 
@@ -39,6 +39,25 @@ async def cb_snooze(call: CallbackQuery):
 @router.message(F.text == "/today")
 @router.message(F.text == "Дни рождения на сегодня")
 async def manual_today(message: Message):
-    if reminder_service:
-        await reminder_service.run_tick(only_uid=message.from_user.id)
-    await message.answer("Проверяю сегодняшние напоминания…")
+    if not reminder_service:
+        await message.answer("Напоминания сейчас недоступны, попробуйте позже.")
+        return
+    report = await reminder_service.check_today(message.from_user.id)
+    await message.answer(_today_text(report))
+
+
+def _today_text(report: TodayReport) -> str:
+    if not report.total:
+        return "Сегодня дней рождения нет."
+    lines = [f"Сегодня дней рождения: {report.total}."]
+    if report.sent:
+        lines.append(f"Отправил напоминаний: {report.sent}.")
+    if report.in_flight:
+        lines.append(f"Уже отправляются: {report.in_flight}.")
+    if report.waiting:
+        lines.append(f"Напомню с {report.start_hour:02d}:00 по вашему времени: {report.waiting}.")
+    if report.done:
+        lines.append(f"Уже поздравлены: {report.done}.")
+    if report.failed:
+        lines.append(f"Не удалось отправить: {report.failed}, попробую ещё раз позже.")
+    return "\n".join(lines)
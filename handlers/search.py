@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+from aiogram import Bot, Router, F, html
+from aiogram.types import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    Message,
+)
+
+from db.db import get_db
+from handlers.edit import edit_menu_kb
+from services.utils import human_date_short, local_now
+
+
+router = Router()
+
+
+FIND_LIMIT = 10
+# Telegram показывает не больше 50 результатов inline-запроса
+INLINE_LIMIT = 20
+
+
+def find_keyboard(rows) -> InlineKeyboardMarkup:
+    # те же кнопки, что в /list: нажатие открывает редактирование записи
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"{r['friend']} — {human_date_short(r['date'])}", callback_data=f"edit:{r['id']}")]
+        for r in rows
+    ])
+
+
+@router.message(F.text.regexp(r"^/find(@\w+)?(\s|$)"))
+async def find_command(message: Message):
+    parts = message.text.split(maxsplit=1)
+    query = parts[1] if len(parts) > 1 else ""
+    if not query.strip():
+        await message.answer("Напишите часть имени: /find Вася\nИли в любом чате наберите @имя_бота и начало имени.")
+        return
+    rows = await get_db().search_birthdays(message.from_user.id, query, limit=FIND_LIMIT)
+    if not rows:
+        await message.answer("Никого не нашёл.")
+        return
+    await message.answer(f"Найдено: {len(rows)}" if len(rows) < FIND_LIMIT else "Первые совпадения:", reply_markup=find_keyboard(rows))
+
+
+@router.inline_query()
+async def inline_search(query: InlineQuery, bot: Bot):
+    db = get_db()
+    uid = query.from_user.id
+    if query.query.strip():
+        rows = await db.search_birthdays(uid, query.query, limit=INLINE_LIMIT)
+    else:
+        # пустой запрос — ближайшие дни рождения
+        tz_offset, _ = await db.get_prefs(uid)
+        items = await db.list_birthdays_sorted(uid, local_now(tz_offset).strftime("%Y-%m-%d")) or []
+        rows = [{"id": it.id, "friend": it.friend, "date": it.date} for it in items[:INLINE_LIMIT]]
+    me = await bot.me()
+    results = []
+    for r in rows:
+        date = human_date_short(r["date"])
+        # в чужом чате callback edit:<id> не сработает — кнопка ведёт в личку с ботом
+        kb = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="✏️ Открыть", url=f"https://t.me/{me.username}?start=edit_{r['id']}")
+        ]])
+        results.append(InlineQueryResultArticle(
+            id=str(r["id"]),
+            title=r["friend"],
+            description=date,
+            input_message_content=InputTextMessageContent(message_text=f"🎂 {html.quote(r['friend'])} — {date}"),
+            reply_markup=kb,
+        ))
+    # результаты личные: кэш на стороне Telegram только для этого пользователя и ненадолго
+    await query.answer(results, cache_time=5, is_personal=True)
+
+
+@router.message(F.text.regexp(r"^/start edit_(\d+)$"))
+async def start_edit(message: Message):
+    bid = int(message.text.rsplit("_", 1)[1])
+    row = await get_db().get_birthday(message.from_user.id, bid)
+    if not row:
+        await message.answer("Запись не найдена")
+        return
+    await message.answer(
+        f"Редактирование: {html.quote(row['friend'])} — {human_date_short(row['date'])}", reply_markup=edit_menu_kb(bid)
+    )
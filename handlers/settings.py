@@ -7,6 +7,7 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from aiogram.exceptions import TelegramBadRequest
 
 from db.db import get_db
+from services.cleanup import get_cleaner
 
 
 router = Router()
@@ -22,6 +23,7 @@ def settings_menu_kb() -> InlineKeyboardMarkup:
         inline_keyboard=[
             [InlineKeyboardButton(text="Изменить часовой пояс", callback_data="set_tz")],
             [InlineKeyboardButton(text="Изменить стартовый час", callback_data="set_hour")],
+            [InlineKeyboardButton(text="Сводка / отдельные напоминания", callback_data="toggle_digest")],
             [InlineKeyboardButton(text="Готово", callback_data="settings_cancel")],
         ]
     )
@@ -29,14 +31,15 @@ def settings_menu_kb() -> InlineKeyboardMarkup:
 
 async def _get_prefs_text(uid: int) -> str:
     db = get_db()
-    prefs = await db.get_user_prefs(uid)
-    tz = int(prefs["tz_offset"]) if prefs else 0
-    hour = int(prefs["start_hour"]) if prefs else 0
+    tz, hour = await db.get_prefs(uid)
+    digest = await db.get_digest_mode(uid)
     sign = "+" if tz >= 0 else ""
+    mode = "одной сводкой со всеми ДР дня" if digest else "отдельным сообщением на каждый ДР"
     return (
         "Настройки уведомлений:\n"
         f"• Часовой пояс: UTC{sign}{tz}\n"
-        f"• Начинать слать с: {hour:02d}:00 (до 23:00)\n\n"
+        f"• Начинать слать с: {hour:02d}:00 (до 23:00)\n"
+        f"• Напоминать: {mode}\n\n"
         "Можно изменить:"
     )
 
@@ -106,18 +109,13 @@ async def set_tz_apply(message: Message, state: FSMContext):
             pass
         return
     db = get_db()
-    prefs = await db.get_user_prefs(message.from_user.id)
-    start_hour = int(prefs["start_hour"]) if prefs else 0
+    _, start_hour = await db.get_prefs(message.from_user.id)
     await db.upsert_user_prefs(uid=message.from_user.id, tz_offset=tz, start_hour=start_hour)
     # удалить пользовательский ввод
     data = await state.get_data()
     mids = list(data.get("user_mids", []))
     mids.append(message.message_id)
-    for mid in mids:
-        try:
-            await message.bot.delete_message(chat_id=message.from_user.id, message_id=int(mid))
-        except TelegramBadRequest:
-            pass
+    get_cleaner().delete(message.from_user.id, *mids)
     await state.update_data(user_mids=[])
     # Вернуть меню в контрол сообщении
     text = await _get_prefs_text(message.from_user.id)
@@ -178,18 +176,13 @@ async def set_hour_apply(message: Message, state: FSMContext):
             pass
         return
     db = get_db()
-    prefs = await db.get_user_prefs(message.from_user.id)
-    tz = int(prefs["tz_offset"]) if prefs else 0
+    tz, _ = await db.get_prefs(message.from_user.id)
     await db.upsert_user_prefs(uid=message.from_user.id, tz_offset=tz, start_hour=val)
     # удалить пользовательский ввод
     data = await state.get_data()
     mids = list(data.get("user_mids", []))
     mids.append(message.message_id)
-    for mid in mids:
-        try:
-            await message.bot.delete_message(chat_id=message.from_user.id, message_id=int(mid))
-        except TelegramBadRequest:
-            pass
+    get_cleaner().delete(message.from_user.id, *mids)
     await state.update_data(user_mids=[])
     # Вернуть меню в контрол сообщении
     text = await _get_prefs_text(message.from_user.id)
@@ -202,24 +195,23 @@ async def set_hour_apply(message: Message, state: FSMContext):
     await state.clear()
 
 
+@router.callback_query(F.data == "toggle_digest")
+async def toggle_digest(call: CallbackQuery):
+    db = get_db()
+    uid = call.from_user.id
+    await db.set_digest_mode(uid, not await db.get_digest_mode(uid))
+    try:
+        await call.message.edit_text(await _get_prefs_text(uid), reply_markup=settings_menu_kb())
+    except TelegramBadRequest:
+        pass
+    await call.answer()
+
+
 @router.callback_query(F.data == "settings_cancel")
 async def settings_cancel(call: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     control_mids = list(data.get("control_mids", []) or [])
     user_mids = list(data.get("user_mids", []) or [])
-    for mid in control_mids:
-        try:
-            await call.bot.delete_message(chat_id=call.from_user.id, message_id=int(mid))
-        except TelegramBadRequest:
-            pass
-    for mid in user_mids:
-        try:
-            await call.bot.delete_message(chat_id=call.from_user.id, message_id=int(mid))
-        except TelegramBadRequest:
-            pass
     await state.clear()
-    try:
-        await call.message.delete()
-    except TelegramBadRequest:
-        pass
+    get_cleaner().delete(call.from_user.id, *control_mids, *user_mids, call.message.message_id if call.message else None)
     await call.answer()
@@ -6,18 +6,22 @@ from pathlib import Path
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from aiogram import __version__ as aiogram_version
 
 from config import load_settings
 from db.db import init_database, get_db
-from handlers import start, add, list as list_handler, edit, reminders as rem_handlers
+from db.fsm import SQLiteStorage
+from handlers import start, add, list as list_handler, edit, search, reminders as rem_handlers
 from handlers import bulk
 from handlers import link
 from handlers import settings as settings_handler
 from handlers import admin as admin_handler
+from services.cleanup import init_cleaner
+from services.delivery import DeliveryEngine, RateLimitMiddleware
+from services.metrics import ApiMetricsMiddleware, instrument_router, register_db, start_metrics_server
 from services.reminder_service import ReminderService
+from services.webhook import derive_secret, run_webhook
 
 
 async def main():
@@ -36,12 +40,36 @@ async def main():
         return
 
     # DB
-    db = init_database(settings.db_path)
+    db = init_database(
+        settings.db_path,
+        readers=settings.db_readers,
+        write_batch_size=settings.db_write_batch_size,
+        write_max_delay_ms=settings.db_write_max_delay_ms,
+        slow_query_ms=settings.db_slow_query_ms,
+        prefs_cache_size=settings.prefs_cache_size,
+        list_cache_size=settings.list_cache_size,
+        change_log=settings.reminder_shards > 1,
+    )
     await db.initialize()
 
     # Bot & Dispatcher
     bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher(storage=MemoryStorage())
+    # Все вызовы Bot API: общий лимит, лимит на чат и автоповтор при flood control.
+    # С воркерами напоминаний общий лимит делится поровну между процессами.
+    bot.session.middleware(
+        RateLimitMiddleware(
+            global_rate=settings.tg_rate_limit / settings.process_count,
+            chat_rate=settings.tg_chat_rate_limit,
+        )
+    )
+    if settings.metrics_port:
+        # после лимитера: считаем сам вызов API, а не ожидание токена
+        bot.session.middleware(ApiMetricsMiddleware())
+    # Состояния диалогов — в той же базе: переживают рестарт, брошенные удаляются по TTL
+    storage = SQLiteStorage(db, ttl=settings.fsm_ttl_hours * 3600, max_bytes=settings.fsm_cache_mb * 1024 * 1024)
+    dp = Dispatcher(storage=storage)
+    # Фоновое удаление сообщений пачками (deleteMessages) для напоминаний и хендлеров
+    cleaner = init_cleaner(bot)
 
     # Health: getMe to validate token and log basic info
     try:
@@ -59,15 +87,22 @@ async def main():
         pass
 
     # Routers
-    dp.include_router(start.router)
-    dp.include_router(add.router)
-    dp.include_router(list_handler.router)
-    dp.include_router(edit.router)
-    dp.include_router(bulk.router)
-    dp.include_router(link.router)
-    dp.include_router(settings_handler.router)
-    dp.include_router(rem_handlers.router)
-    dp.include_router(admin_handler.router)
+    routers = {
+        "start": start.router,
+        "add": add.router,
+        "list": list_handler.router,
+        "search": search.router,
+        "edit": edit.router,
+        "bulk": bulk.router,
+        "link": link.router,
+        "settings": settings_handler.router,
+        "reminders": rem_handlers.router,
+        "admin": admin_handler.router,
+    }
+    for name, router in routers.items():
+        if settings.metrics_port:
+            instrument_router(router, name)
+        dp.include_router(router)
 
     # Scheduler & ReminderService
     scheduler = AsyncIOScheduler(timezone=settings.timezone)
@@ -76,18 +111,59 @@ async def main():
         db=get_db(),
         scheduler=scheduler,
         interval_minutes=settings.reminder_interval_minutes,
+        reping_every=settings.reminder_reping_every,
+        delivery=DeliveryEngine(workers=settings.delivery_workers, max_per_sec=settings.reminder_max_per_sec),
+        cleaner=cleaner,
+        shard_count=settings.reminder_shards,
+        tick_budget_ms=settings.reminder_tick_budget_ms,
+        jitter=settings.reminder_jitter,
     )
     rem_handlers.bind_reminder_service(reminder_service)
-    reminder_service.start()
-    logging.info(
-        "Scheduler started: tz=%s, interval=%s min, jobs=%s",
-        settings.timezone,
-        settings.reminder_interval_minutes,
-        len(scheduler.get_jobs()),
-    )
+    if settings.reminder_shards == 1:
+        reminder_service.start()
+        logging.info(
+            "Scheduler started: tz=%s, interval=%s min, jobs=%s",
+            settings.timezone,
+            settings.reminder_interval_minutes,
+            len(scheduler.get_jobs()),
+        )
+    else:
+        # расписание и рассылку ведут reminder_worker.py; здесь — только кнопки и /today
+        logging.info("Напоминания ведут воркеры: REMINDER_SHARDS=%s", settings.reminder_shards)
+
+    metrics_runner = None
+    if settings.metrics_port:
+        register_db(db)
+        metrics_runner = await start_metrics_server(settings.metrics_host, settings.metrics_port)
 
     logging.info("Бот запущен. Нажмите Ctrl+C для остановки.")
-    await dp.start_polling(bot)
+    try:
+        if settings.webhook_port:
+            await run_webhook(
+                dp,
+                bot,
+                host=settings.webhook_host,
+                port=settings.webhook_port,
+                path=settings.webhook_path,
+                url=settings.webhook_url,
+                secret=settings.webhook_secret or derive_secret(settings.bot_token),
+                max_concurrency=settings.webhook_max_concurrency,
+                drain_timeout=settings.webhook_drain_timeout,
+            )
+        else:
+            # getUpdates не работает, пока установлен webhook (например, после запуска в режиме webhook)
+            await bot.delete_webhook()
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        # дочистить отложенные удаления, дописать очередь записи и закрыть соединения
+        if settings.reminder_shards == 1:
+            await reminder_service.stop()
+        await cleaner.close()
+        await bot.session.close()
+        await storage.close()
+        db.close()
 
 
 if __name__ == "__main__":
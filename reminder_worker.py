@@ -0,0 +1,109 @@
+"""Reminder worker: schedules and delivers reminders for one uid partition, no polling.
+
+Run REMINDER_SHARDS of these next to main.py (which then only serves the chat):
+    REMINDER_SHARDS=4 python reminder_worker.py --shard 0
+    ...
+    REMINDER_SHARDS=4 python reminder_worker.py --shard 3
+Each worker owns uid % REMINDER_SHARDS == shard and takes over partitions of workers whose
+lease in reminder_leases has expired.
+"""
+import argparse
+import asyncio
+import logging
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from config import load_settings
+from db.db import init_database
+from services.cleanup import init_cleaner
+from services.delivery import DeliveryEngine, RateLimitMiddleware
+from services.metrics import ApiMetricsMiddleware, register_db, start_metrics_server
+from services.reminder_service import ReminderService
+
+
+async def main():
+    settings = load_settings()
+    parser = argparse.ArgumentParser(description="Reminder worker for one uid partition")
+    parser.add_argument("--shard", type=int, default=settings.reminder_shard, help="partition id, 0..REMINDER_SHARDS-1")
+    parser.add_argument("--shards", type=int, default=settings.reminder_shards, help="number of partitions")
+    args = parser.parse_args()
+    shards = max(1, args.shards)
+    shard = args.shard % shards
+
+    log_path = Path(__file__).with_name(f"reminder-worker-{shard}.log")
+    handlers = [logging.StreamHandler()]
+    try:
+        handlers.append(RotatingFileHandler(log_path, maxBytes=2_000_000, backupCount=3, encoding="utf-8"))
+    except Exception:
+        pass
+    logging.basicConfig(level=logging.INFO, handlers=handlers, format="%(asctime)s %(levelname)s %(message)s")
+    if not settings.bot_token:
+        logging.error("REMIND_BOT_TOKEN не задан. Установите переменную окружения REMIND_BOT_TOKEN и перезапустите.")
+        return
+
+    db = init_database(
+        settings.db_path,
+        readers=settings.db_readers,
+        write_batch_size=settings.db_write_batch_size,
+        write_max_delay_ms=settings.db_write_max_delay_ms,
+        slow_query_ms=settings.db_slow_query_ms,
+        prefs_cache_size=settings.prefs_cache_size,
+        change_log=shards > 1,
+    )
+    await db.initialize()
+
+    bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # общий лимит Bot API делится между процессом бота и воркерами
+    bot.session.middleware(
+        RateLimitMiddleware(
+            global_rate=settings.tg_rate_limit / (shards + 1),
+            chat_rate=settings.tg_chat_rate_limit,
+        )
+    )
+    metrics_runner = None
+    if settings.metrics_port:
+        # у каждого воркера свой порт: METRICS_PORT + 1 + shard (METRICS_PORT — у процесса бота)
+        bot.session.middleware(ApiMetricsMiddleware())
+        register_db(db)
+        metrics_runner = await start_metrics_server(settings.metrics_host, settings.metrics_port + 1 + shard)
+    cleaner = init_cleaner(bot)
+
+    scheduler = AsyncIOScheduler(timezone=settings.timezone)
+    service = ReminderService(
+        bot=bot,
+        db=db,
+        scheduler=scheduler,
+        interval_minutes=settings.reminder_interval_minutes,
+        reping_every=settings.reminder_reping_every,
+        # потолок REMINDER_MAX_PER_SEC общий на все разделы
+        delivery=DeliveryEngine(workers=settings.delivery_workers, max_per_sec=settings.reminder_max_per_sec / shards),
+        cleaner=cleaner,
+        shard_id=shard,
+        shard_count=shards,
+        lease_ttl=settings.reminder_lease_ttl,
+        tick_budget_ms=settings.reminder_tick_budget_ms,
+        jitter=settings.reminder_jitter,
+    )
+    service.start()
+    logging.info("Воркер напоминаний запущен: раздел %s из %s", shard, shards)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await service.stop()
+        await cleaner.close()
+        await bot.session.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
+        print("Воркер остановлен.")
@@ -0,0 +1,107 @@
+"""Benchmark: "who's due today" lookups, `date LIKE '%-MM-DD'` vs indexed mmdd range.
+
+Usage: python scripts/bench_mmdd.py [rows] [users]
+Creates a throwaway database in a temp dir, fills it with the pre-mmdd schema,
+measures the old LIKE queries, runs the Database migration and measures the new ones.
+"""
+from __future__ import annotations
+
+import asyncio
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db.db import Database, mmdd_bounds  # noqa: E402
+
+
+OLD_SCHEMA = """
+CREATE TABLE birthdays (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    friend TEXT NOT NULL,
+    phone TEXT NULL,
+    tg_nic TEXT NULL,
+    tg_id INTEGER NULL,
+    already_remaind INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX idx_birthdays_uid ON birthdays(uid);
+CREATE INDEX idx_birthdays_date ON birthdays(date);
+"""
+
+
+def fill(path: str, rows: int, users: int) -> None:
+    rnd = random.Random(42)
+    conn = sqlite3.connect(path)
+    conn.executescript(OLD_SCHEMA)
+
+    def gen():
+        for i in range(rows):
+            year = rnd.choice((0, rnd.randint(1950, 2010)))
+            month = rnd.randint(1, 12)
+            day = rnd.randint(1, 28)
+            yield (rnd.randint(1, users), f"{year:04d}-{month:02d}-{day:02d}", f"friend {i}")
+
+    with conn:
+        conn.executemany("INSERT INTO birthdays (uid, date, friend) VALUES (?, ?, ?)", gen())
+    conn.close()
+
+
+async def timed(label: str, coro_factory, repeat: int) -> None:
+    best = float("inf")
+    n = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = await coro_factory()
+        best = min(best, time.perf_counter() - t0)
+        n = len(res)
+    print(f"  {label:<40} {best * 1000:9.2f} ms  ({n} rows)")
+
+
+async def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bench.sqlite3")
+        t0 = time.perf_counter()
+        fill(path, rows, users)
+        print(f"filled {rows} rows / {users} users in {time.perf_counter() - t0:.1f}s")
+
+        db = Database(path)
+        uid = 1
+
+        print("before (date LIKE '%-06-15'):")
+        await timed("select_today_all", lambda: db.fetchall("SELECT * FROM birthdays WHERE date LIKE ?", ("%-06-15",)), 5)
+        await timed(
+            "select_user_today_all",
+            lambda: db.fetchall("SELECT * FROM birthdays WHERE uid = ? AND date LIKE ?", (uid, "%-06-15")),
+            5,
+        )
+
+        t0 = time.perf_counter()
+        await db.initialize()
+        print(f"migration (add mmdd + backfill + indexes): {time.perf_counter() - t0:.1f}s")
+
+        print("after (mmdd BETWEEN lo AND hi):")
+        june15 = mmdd_bounds("06", "15", 2025)
+        feb28 = mmdd_bounds("02", "28", 2025)
+        await timed("select_today_all", lambda: db.fetchall("SELECT * FROM birthdays WHERE mmdd BETWEEN ? AND ?", june15), 5)
+        await timed(
+            "select_user_today_all",
+            lambda: db.fetchall("SELECT * FROM birthdays WHERE uid = ? AND mmdd BETWEEN ? AND ?", (uid, *june15)),
+            5,
+        )
+        await timed(
+            "select_today_all, 28 Feb non-leap (+29 Feb)",
+            lambda: db.fetchall("SELECT * FROM birthdays WHERE mmdd BETWEEN ? AND ?", feb28),
+            5,
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
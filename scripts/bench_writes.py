@@ -0,0 +1,88 @@
+"""Benchmark: bursty concurrent writes/reads, shared connection vs Database engine.
+
+Usage: python scripts/bench_writes.py [writes] [reads]
+"baseline" is the previous engine: one shared sqlite3 connection, a commit per
+execute, every call through asyncio.to_thread. It gets a lock here: without one,
+concurrent calls on the shared connection fail with "cannot start a transaction
+within a transaction". "engine" is db.Database with the reader pool and the
+group-committing writer.
+"""
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db.db import Database  # noqa: E402
+
+
+UPSERT = (
+    "INSERT INTO last_notifications(uid, birthday_id, message_id, date, extra_message_id) VALUES(?, ?, ?, ?, ?) "
+    "ON CONFLICT(uid, birthday_id) DO UPDATE SET message_id = excluded.message_id, date = excluded.date"
+)
+READ = "SELECT * FROM birthdays WHERE uid = ?"
+
+
+class Baseline:
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL;")
+
+    async def execute(self, query, params):
+        def run():
+            with self._lock, self._conn:
+                self._conn.execute(query, params)
+
+        await asyncio.to_thread(run)
+
+    async def fetchall(self, query, params):
+        def run():
+            with self._lock:
+                return self._conn.execute(query, params).fetchall()
+
+        return await asyncio.to_thread(run)
+
+    def close(self):
+        self._conn.close()
+
+
+async def run(name: str, db, writes: int, reads: int) -> None:
+    t0 = time.perf_counter()
+    await asyncio.gather(*(db.execute(UPSERT, (i % 500, i, i, "2025-01-01", None)) for i in range(writes)))
+    w = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    await asyncio.gather(*(db.fetchall(READ, (i % 500,)) for i in range(reads)))
+    r = time.perf_counter() - t0
+    print(f"  {name:<9} writes: {writes / w:9.0f}/s ({w:.2f}s)   reads: {reads / r:9.0f}/s ({r:.2f}s)")
+
+
+async def main() -> None:
+    writes = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    reads = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("baseline", "engine"):
+            path = str(Path(tmp) / f"{name}.sqlite3")
+            db = Database(path)
+            await db.initialize()
+            await db.execute_script(
+                "WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < 49999) "
+                "INSERT INTO birthdays (uid, date, friend, mmdd) SELECT i % 500, '0000-01-01', 'f' || i, 101 FROM n;"
+            )
+            if name == "baseline":
+                db.close()
+                db = Baseline(path)
+            await run(name, db, writes, reads)
+            db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
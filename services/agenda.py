@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+
+class Agenda:
+    """Today's pending birthdays in memory, grouped by timezone bucket:
+    tz_offset -> (local date of the bucket, {uid: {birthday_id, ...}}).
+
+    A bucket is (re)loaded when its local day starts; single users are refreshed after
+    their writes, so a tick only reads from here instead of querying the database.
+    """
+
+    def __init__(self) -> None:
+        self._buckets: dict[int, tuple[str, dict[int, set[int]]]] = {}
+        self._uid_offset: dict[int, int] = {}
+
+    def load_bucket(self, tz_offset: int, local_date: str, rows: Iterable[tuple[int, int]]) -> None:
+        """Replace the whole bucket with (uid, birthday_id) pairs due on local_date."""
+        old = self._buckets.get(tz_offset)
+        if old is not None:
+            for uid in old[1]:
+                if self._uid_offset.get(uid) == tz_offset:
+                    del self._uid_offset[uid]
+        users: dict[int, set[int]] = {}
+        for uid, bid in rows:
+            if uid not in users:
+                # the user may still sit in the bucket of their previous timezone
+                self._drop_user(uid)
+                users[uid] = set()
+                self._uid_offset[uid] = tz_offset
+            users[uid].add(bid)
+        self._buckets[tz_offset] = (local_date, users)
+
+    def set_user(self, uid: int, tz_offset: int, local_date: str, bids: Iterable[int]) -> None:
+        """Replace one user's pending birthdays (e.g. after an add/edit/delete or a tz change)."""
+        self._drop_user(uid)
+        bids = set(bids)
+        if not bids:
+            return
+        bucket = self._buckets.get(tz_offset)
+        if bucket is None or bucket[0] < local_date:
+            # the bucket's day is over but it has not been reloaded yet: its other users are stale
+            self.load_bucket(tz_offset, local_date, ())
+        elif bucket[0] > local_date:
+            return
+        self._buckets[tz_offset][1][uid] = bids
+        self._uid_offset[uid] = tz_offset
+
+    def discard_user(self, uid: int) -> None:
+        self._drop_user(uid)
+
+    def _drop_user(self, uid: int) -> None:
+        offset = self._uid_offset.pop(uid, None)
+        if offset is not None:
+            self._buckets[offset][1].pop(uid, None)
+
+    def due(self, uids: Iterable[int]) -> list[tuple[int, int, str]]:
+        """(uid, birthday_id, local_date) of the given users."""
+        out: list[tuple[int, int, str]] = []
+        for uid in uids:
+            offset = self._uid_offset.get(uid)
+            if offset is None:
+                continue
+            local_date, users = self._buckets[offset]
+            out.extend((uid, bid, local_date) for bid in sorted(users.get(uid, ())))
+        return out
+
+    def uids(self) -> list[int]:
+        return list(self._uid_offset)
+
+    def __len__(self) -> int:
+        return sum(len(bids) for _, users in self._buckets.values() for bids in users.values())
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self._uid_offset
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+
+# deleteMessages принимает не больше 100 id за вызов
+MAX_IDS_PER_CALL = 100
+
+
+class MessageCleaner:
+    """Deletes messages in the background: ids are collected per chat for `delay` seconds
+    and removed with one deleteMessages call per chat (per 100 ids) instead of a
+    deleteMessage call each. Callers never wait for the Bot API and never see its errors.
+    """
+
+    def __init__(self, bot: Bot, delay: float = 0.2):
+        self.bot = bot
+        self.delay = max(0.0, delay)
+        self._pending: dict[int, set[int]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.calls = 0
+        self.fallbacks = 0
+
+    def delete(self, chat_id: int, *message_ids: Optional[int]) -> None:
+        ids = {int(mid) for mid in message_ids if mid}
+        if not ids:
+            return
+        self._pending.setdefault(int(chat_id), set()).update(ids)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    async def flush(self) -> None:
+        while self._pending:
+            pending, self._pending = self._pending, {}
+            await asyncio.gather(*(self._delete_chat(chat_id, sorted(ids)) for chat_id, ids in pending.items()))
+
+    async def _delete_chat(self, chat_id: int, ids: list[int]) -> None:
+        for i in range(0, len(ids), MAX_IDS_PER_CALL):
+            chunk = ids[i:i + MAX_IDS_PER_CALL]
+            try:
+                # messages that are gone or too old are skipped by Telegram itself
+                await self.bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+                self.calls += 1
+                continue
+            except TelegramAPIError as e:
+                logging.debug(f"deleteMessages в чате {chat_id} не прошёл ({e}), удаляю по одному")
+            except Exception:
+                logging.exception(f"Не удалось удалить сообщения в чате {chat_id}")
+                continue
+            self.fallbacks += 1
+            for mid in chunk:
+                try:
+                    await self.bot.delete_message(chat_id=chat_id, message_id=mid)
+                    self.calls += 1
+                except TelegramAPIError:
+                    pass
+                except Exception:
+                    logging.exception(f"Не удалось удалить сообщение {mid} в чате {chat_id}")
+
+    async def close(self) -> None:
+        # the pending flush sleeps at most `delay`; let it finish rather than lose ids
+        if self._task is not None and not self._task.done():
+            await self._task
+        await self.flush()
+
+
+_cleaner: MessageCleaner | None = None
+
+
+def init_cleaner(bot: Bot, **options) -> MessageCleaner:
+    global _cleaner
+    _cleaner = MessageCleaner(bot, **options)
+    return _cleaner
+
+
+def get_cleaner() -> MessageCleaner:
+    assert _cleaner is not None, "MessageCleaner is not initialized"
+    return _cleaner
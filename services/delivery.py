@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetUpdates, TelegramMethod
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `capacity` in a burst.
+    Waiters are served in FIFO order."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = max(0.01, float(rate))
+        self.capacity = max(1.0, float(capacity if capacity is not None else rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        # Telegram asked us to back off: nobody gets a token until then
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    @property
+    def idle(self) -> bool:
+        return not self._lock.locked() and self._tokens >= self.capacity - 1e-9
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Bot API request middleware: global token bucket for every call, per-chat bucket for
+    message-producing calls, transparent retries on TelegramRetryAfter."""
+
+    # Методы, которые Telegram считает «сообщениями в чат» (лимит ~1 в секунду на чат)
+    CHAT_LIMITED_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        global_burst: float = 5.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_retries: int = 3,
+        max_chats: int = 10_000,
+    ):
+        # small burst: a full bucket of `rate` tokens would allow ~2x rate in the first second
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats: OrderedDict[Any, TokenBucket] = OrderedDict()
+        self.retries = 0
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            # выбрасываем самые давние простаивающие чаты
+            while len(self._chats) > self.max_chats:
+                old_id, old = next(iter(self._chats.items()))
+                if not old.idle:
+                    break
+                del self._chats[old_id]
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ):
+        if isinstance(method, GetUpdates):
+            # long polling is not a message and may hang for its whole timeout
+            return await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None)
+        chat_limited = chat_id is not None and type(method).__name__.startswith(self.CHAT_LIMITED_PREFIXES)
+        attempt = 0
+        while True:
+            if chat_limited:
+                await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                logging.warning(f"Flood control: {type(method).__name__}, повтор через {e.retry_after} с")
+                if chat_limited:
+                    self._chat_bucket(chat_id).pause(e.retry_after)
+                else:
+                    self.global_bucket.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+
+
+@dataclass
+class DeliveryReport:
+    sent: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class DeliveryEngine:
+    """Runs delivery jobs on a bounded pool of async workers.
+    Rate limits and RetryAfter handling live in RateLimitMiddleware, so workers are free
+    to overlap round-trips up to what the API allows. max_per_sec optionally caps how many
+    jobs start per second, below the API limit, leaving room for chat replies."""
+
+    def __init__(self, workers: int = 8, max_per_sec: float = 0):
+        self.workers = max(1, workers)
+        # no burst: the point is a flat send rate
+        self.bucket = TokenBucket(max_per_sec, 1.0) if max_per_sec > 0 else None
+
+    async def run(self, jobs: Iterable[Callable[[], Awaitable[Any]]]) -> DeliveryReport:
+        queue: asyncio.Queue[Callable[[], Awaitable[Any]]] = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+        report = DeliveryReport()
+        if queue.empty():
+            return report
+
+        async def worker() -> None:
+            while True:
+                try:
+                    job = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if self.bucket is not None:
+                    await self.bucket.acquire()
+                try:
+                    await job()
+                    report.sent += 1
+                except Exception:
+                    # job logs its own error with context
+                    report.failed += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, queue.qsize()))))
+        report.elapsed = time.monotonic() - started
+        return report
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+from aiogram import BaseMiddleware, Bot, Router
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiohttp import web
+
+from db.db import Database
+from db.stats import BUCKETS_MS
+
+
+# Seconds; Bot API round-trips, handler runs and ticks all fit in here
+DEFAULT_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, value: float = 1, **labels: Any) -> None:
+        key = tuple(labels.get(n, "") for n in self.labels)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, v in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, key)} {_num(v)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(labels.get(n, "") for n in self.labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = ([0] * len(self.buckets), [0.0])
+        counts, total = entry
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._values.items()):
+            lines += _histogram_lines(self.name, self.labels, key, self.buckets, counts, total[0])
+        return lines
+
+
+def _histogram_lines(
+    name: str, label_names: tuple[str, ...], key: tuple, buckets: tuple[float, ...], counts: list[int], total: float
+) -> list[str]:
+    # counts are per bucket; the exposition format wants them cumulative
+    lines = []
+    acc = 0
+    for bound, n in zip(buckets, counts):
+        acc += n
+        le = 'le="' + _num(bound) + '"'
+        lines.append(f"{name}_bucket{_labels(label_names, key, le)} {acc}")
+    lines.append(f"{name}_sum{_labels(label_names, key)} {_num(total)}")
+    lines.append(f"{name}_count{_labels(label_names, key)} {acc}")
+    return lines
+
+
+class Registry:
+    """Counters and histograms updated in place, plus collectors that are asked for
+    their lines at scrape time (gauges read from the DB, the query stats, ...)."""
+
+    def __init__(self) -> None:
+        self._metrics: list[Counter | Histogram] = []
+        self._collectors: list[Callable[[], Awaitable[list[str]]]] = []
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], Awaitable[list[str]]]) -> None:
+        self._collectors.append(fn)
+
+    async def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for fn in self._collectors:
+            try:
+                lines += await fn()
+            except Exception:
+                logging.exception("metrics collector failed")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+TICK_SECONDS = REGISTRY.histogram("reminder_tick_seconds", "Time to select and enqueue one reminder tick")
+TICK_USERS = REGISTRY.counter("reminder_tick_users_total", "Users looked at by reminder ticks")
+TICK_DUE = REGISTRY.counter("reminder_tick_due_total", "Due reminders found by ticks")
+TICK_LAG_SECONDS = REGISTRY.histogram(
+    "reminder_tick_lag_seconds", "How late the earliest due user was served", buckets=(1, 5, 15, 60, 300, 900, 3600)
+)
+TICK_OVERRUNS = REGISTRY.counter("reminder_tick_overruns_total", "Passes that ran over budget or behind schedule", ["reason"])
+JOBS_SKIPPED = REGISTRY.counter("scheduler_jobs_skipped_total", "APScheduler runs skipped or missed", ["job", "reason"])
+NOTIFICATIONS = REGISTRY.counter("reminder_notifications_total", "Reminder deliveries by result", ["result"])
+API_SECONDS = REGISTRY.histogram("telegram_api_request_seconds", "Bot API call latency", ["method"])
+API_ERRORS = REGISTRY.counter("telegram_api_errors_total", "Bot API calls that raised", ["method", "error"])
+UPDATE_SECONDS = REGISTRY.histogram("bot_update_seconds", "Update handling time per router", ["router", "event"])
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Bot API latency per method. Register it after RateLimitMiddleware so that the
+    time spent waiting for a token is not counted."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=name)
+
+
+class _UpdateTimer(BaseMiddleware):
+    def __init__(self, router: str, event: str):
+        self.router = router
+        self.event = event
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started, router=self.router, event=self.event)
+
+
+def instrument_router(router: Router, name: str) -> None:
+    # inner middlewares: only run when a handler of this router matched
+    for event, observer in router.observers.items():
+        if event not in ("update", "error"):
+            observer.middleware(_UpdateTimer(name, event))
+
+
+def register_db(db: Database) -> None:
+    """Query timings (db.stats, see db/stats.py) and outbox depth, read at scrape time."""
+
+    async def outbox() -> list[str]:
+        depth = await db.outbox_depth()
+        lines = ["# HELP reminder_outbox_jobs Outbox jobs by status", "# TYPE reminder_outbox_jobs gauge"]
+        for status in ("pending", "sending", "sent", "failed", "dropped"):
+            lines.append(f'reminder_outbox_jobs{{status="{status}"}} {depth.get(status, 0)}')
+        return lines
+
+    async def queries() -> list[str]:
+        buckets = tuple(b / 1000 for b in BUCKETS_MS)
+        lines = ["# HELP db_query_seconds SQLite statement time (queue + exec)", "# TYPE db_query_seconds histogram"]
+        for st in db.stats.snapshot():
+            lines += _histogram_lines(
+                "db_query_seconds", ("id", "statement"), (st.id, st.sql[:120]), buckets, st.buckets, st.total_ms / 1000
+            )
+        pc = db.prefs_cache.stats()
+        lines += ["# HELP prefs_cache_requests_total Prefs cache lookups", "# TYPE prefs_cache_requests_total counter"]
+        lines.append(f'prefs_cache_requests_total{{result="hit"}} {pc["hits"]}')
+        lines.append(f'prefs_cache_requests_total{{result="miss"}} {pc["misses"]}')
+        return lines
+
+    REGISTRY.collector(outbox)
+    REGISTRY.collector(queries)
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve REGISTRY as text at http://host:port/metrics."""
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=await REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Метрики: http://{host}:{port}/metrics")
+    return runner
@@ -1,19 +1,51 @@
 from __future__ import annotations
 
 import asyncio
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import datetime as dt
 import logging
+import os
+import socket
+import time
+from collections import Counter
 from typing import Optional
 
-from aiogram import Bot
-from aiogram.exceptions import TelegramBadRequest
+from aiogram import Bot, html
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
-from db.db import Database
-from services.utils import get_age_text, human_date_short, today_str
+from db.db import TZ_OFFSETS, Database
+from services.agenda import Agenda
+from services.cleanup import MessageCleaner
+from services.delivery import DeliveryEngine, DeliveryReport
+from services.metrics import (
+    JOBS_SKIPPED,
+    NOTIFICATIONS,
+    TICK_DUE,
+    TICK_LAG_SECONDS,
+    TICK_OVERRUNS,
+    TICK_SECONDS,
+    TICK_USERS,
+)
+from services.schedule import DueQueue, floor_to_interval, jitter_seconds, next_due_at
+from services.utils import get_age_text, human_date_short, local_today_str, today_str
+
+
+# Outbox: опрос на случай отложенных повторов и экспоненциальная пауза между попытками, с
+OUTBOX_POLL_S = 30.0
+OUTBOX_RETRY_BASE_S = 30
+OUTBOX_RETRY_MAX_S = 900
+# Due-пользователей ставим в outbox кусками по столько, проверяя бюджет прохода между ними
+TICK_CHUNK = 1000
+# Сводка: сколько ДР перечислять с кнопками (лимиты Telegram на длину текста и клавиатуру)
+DIGEST_MAX_ROWS = 30
+# Шардированные воркеры: как часто смотреть change_log (изменения из процесса бота), с
+CHANGE_POLL_S = 2.0
+# Задание, которое дольше этого висит в 'sending', считается брошенным (его воркер упал), с
+OUTBOX_SENDING_TIMEOUT_S = 300
 
 
 def reminder_keyboard(birthday_id: int, with_link: bool = False) -> InlineKeyboardMarkup:
@@ -28,59 +60,359 @@ def reminder_keyboard(birthday_id: int, with_link: bool = False) -> InlineKeyboa
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
+def digest_keyboard(rows) -> InlineKeyboardMarkup:
+    # по строке на человека: «уже поздравил» и «отложить» для каждого ДР сводки
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text=f"✅ {row['friend'][:24]}", callback_data=f"remind_done:{int(row['id'])}"),
+                InlineKeyboardButton(text="Отложить", callback_data=f"remind_snooze:{int(row['id'])}"),
+            ]
+            for row in rows
+        ]
+    )
+
+
+def _utcnow() -> dt.datetime:
+    return dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)
+
+
+@dataclass
+class TodayReport:
+    """Outcome of a manual /today check for one user."""
+
+    total: int = 0        # birthdays on the user's local today
+    done: int = 0         # already congratulated («Уже поздравил»)
+    waiting: int = 0      # before the user's start_hour: the scheduler will remind later
+    sent: int = 0
+    failed: int = 0
+    in_flight: int = 0    # already being sent by the delivery loop or waiting for a retry
+    start_hour: int = 0
+
+
 @dataclass
 class ReminderService:
     bot: Bot
     db: Database
     scheduler: AsyncIOScheduler
     interval_minutes: int = 60
+    delivery: DeliveryEngine = field(default_factory=DeliveryEngine)
+    # outbox: сколько заданий брать за раз и сколько попыток на одно задание
+    outbox_batch: int = 200
+    outbox_max_attempts: int = 5
+    # повтор в тот же день правит уже отправленное напоминание; каждое reping_every-е — новый пуш
+    reping_every: int = 3
+    # удаление сообщений пачками (deleteMessages); по умолчанию — свой экземпляр на этого бота
+    cleaner: Optional[MessageCleaner] = None
+    # Шардирование по процессам: воркер shard_id из shard_count ведёт uid с uid % shard_count == shard_id
+    # (и подхватывает разделы упавших воркеров через reminder_leases). shard_count=1 — всё в одном процессе.
+    shard_id: int = 0
+    shard_count: int = 1
+    lease_ttl: float = 60.0
+    # сколько один проход цикла может ставить напоминания в очередь, прежде чем уступить
+    tick_budget_ms: int = 2000
+    # сдвиг каждого пользователя внутри интервала по uid, чтобы рассылка не шла пачкой в :00
+    jitter: bool = True
+    # Что напоминать: несделанные ДР «на сегодня» по бакетам часовых поясов, см. services/agenda.py
+    agenda: Agenda = field(default_factory=Agenda, init=False)
+    # Кого и когда будить: мин-куча «следующий момент напоминания» по пользователям
+    _queue: DueQueue = field(default_factory=DueQueue, init=False, repr=False)
+    _prefs: dict[int, tuple[int, int]] = field(default_factory=dict, init=False, repr=False)
+    _dirty: set[int] = field(default_factory=set, init=False, repr=False)
+    _wake: Optional[asyncio.Event] = field(default=None, init=False, repr=False)
+    _loop_task: Optional[asyncio.Task] = field(default=None, init=False, repr=False)
+    _outbox_wake: Optional[asyncio.Event] = field(default=None, init=False, repr=False)
+    _drain_task: Optional[asyncio.Task] = field(default=None, init=False, repr=False)
+    _owned: set[int] = field(default_factory=set, init=False, repr=False)
+    _owner: str = field(default="", init=False, repr=False)
+    _change_seq: int = field(default=0, init=False, repr=False)
+    _shard_task: Optional[asyncio.Task] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.cleaner is None:
+            self.cleaner = MessageCleaner(self.bot)
+        self.shard_count = max(1, self.shard_count)
+        self.shard_id %= self.shard_count
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{self.shard_id}"
+        if not self.sharded:
+            self._owned = {0}
 
     def start(self):
-        # Periodic reminders aligned to wall clock boundaries.
-        # If interval divides 60, use cron (*/N) to align to :00, :N, ...
-        if self.interval_minutes >= 1 and 60 % self.interval_minutes == 0:
-            step = self.interval_minutes
-            if step == 60:
-                trig = CronTrigger(minute=0)
-            else:
-                # APScheduler supports step notation
-                trig = CronTrigger(minute=f"*/{step}")
-            self.scheduler.add_job(self._tick_job, trig)
-        else:
-            # Fallback: interval trigger, align next run to the next boundary
+        # Event-driven: the loop sleeps until the earliest user's next due instant instead
+        # of waking up every interval and scanning everybody.
+        self._wake = asyncio.Event()
+        self.db.subscribe(self._on_db_change)
+        # Every UTC hour some timezone bucket starts a new local day — pick up its users
+        self.scheduler.add_job(
+            self._day_start_job,
+            CronTrigger(minute=0, timezone="UTC"),
+            id="day_start",
+            coalesce=True,
+            misfire_grace_time=15 * 60,
+        )
+        # APScheduler молча пропускает запуск, если предыдущий ещё идёт (max_instances=1)
+        self.scheduler.add_listener(self._on_job_skipped, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+        # Ежедневный сброс не нужен: «поздравил» хранится как локальная дата (birthdays.notified_on)
+        self.scheduler.start()
+        self._outbox_wake = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._loop_task = loop.create_task(self._run_loop())
+        # отправка отвязана от тика: медленный Bot API не задерживает планировщик
+        self._drain_task = loop.create_task(self._drain_loop())
+
+    async def stop(self):
+        for task in (self._loop_task, self._drain_task, self._shard_task):
+            if task is not None:
+                task.cancel()
+        try:
+            self.scheduler.shutdown(wait=False)
+        except Exception:
+            pass
+        if self.sharded:
+            # отдать разделы сразу, не дожидаясь истечения аренды
+            await self.db.release_leases(self._owner)
+
+    @property
+    def scheduled_users(self) -> int:
+        return len(self._queue)
+
+    @property
+    def sharded(self) -> bool:
+        return self.shard_count > 1
+
+    @property
+    def owned_shards(self) -> set[int]:
+        return set(self._owned)
+
+    def _owns(self, uid: int) -> bool:
+        return not self.sharded or uid % self.shard_count in self._owned
+
+    def _shard_filter(self, shards: set[int] | None = None) -> tuple[int, list[int]] | None:
+        if not self.sharded:
+            return None
+        return self.shard_count, sorted(self._owned if shards is None else shards)
+
+    async def _refresh_leases(self, initial: bool = False) -> None:
+        # Свой раздел берём всегда (и забираем у подменившего нас воркера), чужие — только
+        # если их аренда истекла, т.е. их воркер упал.
+        owned: set[int] = set()
+        for shard in range(self.shard_count):
+            if await self.db.acquire_lease(shard, self._owner, self.lease_ttl, home=shard == self.shard_id):
+                owned.add(shard)
+        gained, lost = owned - self._owned, self._owned - owned
+        self._owned = owned
+        # Отправки упавшего воркера (и свои, оставшиеся с прошлого запуска) — снова в очередь.
+        # Только свои разделы и только давно взятые: раздел мог перейти от живого воркера,
+        # который ещё отправляет.
+        if owned:
+            cutoff = _utcnow() - dt.timedelta(seconds=OUTBOX_SENDING_TIMEOUT_S)
+            requeued = await self.db.requeue_inflight_outbox(cutoff, shard=self._shard_filter())
+            if requeued:
+                logging.info(f"Outbox: {requeued} брошенных отправок в разделах {sorted(owned)} возвращены в очередь")
+                if self._outbox_wake is not None:
+                    self._outbox_wake.set()
+        if lost:
+            logging.warning(f"Воркер {self._owner}: разделы {sorted(lost)} отданы другому воркеру")
+            for uid in set(self._prefs) | set(self.agenda.uids()):
+                if uid % self.shard_count in lost:
+                    self._queue.discard(uid)
+                    self._prefs.pop(uid, None)
+                    self.agenda.discard_user(uid)
+        if gained:
+            logging.info(f"Воркер {self._owner}: ведёт разделы {sorted(owned)} из {self.shard_count}")
+            if not initial:
+                await self._reschedule(None, shards=gained)
+                if self._wake is not None:
+                    self._wake.set()
+
+    async def _shard_loop(self):
+        # Аренда разделов и изменения, сделанные другими процессами (бот пишет, воркер читает change_log)
+        renewed = time.monotonic()
+        while True:
+            await asyncio.sleep(CHANGE_POLL_S)
             try:
-                tznow = dt.datetime.now(self.scheduler.timezone)
+                if time.monotonic() - renewed >= self.lease_ttl / 3:
+                    await self._refresh_leases()
+                    renewed = time.monotonic()
+                rows = await self.db.changes_since(self._change_seq)
+                if rows:
+                    self._change_seq = int(rows[-1]["seq"])
+                    for r in rows:
+                        # настройки мог поменять процесс бота — кэш этого процесса о том не знает
+                        self.db.prefs_cache.invalidate(int(r["uid"]))
+                        self._on_db_change(int(r["uid"]))
+            except asyncio.CancelledError:
+                raise
             except Exception:
-                tznow = dt.datetime.now()
-            minute = tznow.minute
-            step = max(1, self.interval_minutes)
-            next_minute = ((minute // step) + 1) * step
-            delta_min = next_minute - minute
-            if delta_min <= 0:
-                delta_min += step
-            next_run = tznow.replace(second=0, microsecond=0) + dt.timedelta(minutes=delta_min)
-            self.scheduler.add_job(
-                self._tick_job,
-                "interval",
-                minutes=self.interval_minutes,
-                next_run_time=next_run,
-            )
-        # Daily reset at 00:05
-        self.scheduler.add_job(self._daily_reset, CronTrigger(hour=0, minute=5))
-        self.scheduler.start()
+                logging.exception("Ошибка в цикле аренды разделов")
+
+    def _on_db_change(self, uid: int) -> None:
+        # birthdays or prefs of uid changed: recompute its next instant in the loop
+        if not self._owns(uid):
+            return
+        self._dirty.add(uid)
+        if self._wake is not None:
+            self._wake.set()
 
-    async def _daily_reset(self):
-        await self.db.reset_daily_flags()
+    def _schedule(
+        self, uid: int, tz_offset: int, start_hour: int, now_utc: dt.datetime, catch_up: bool = False
+    ) -> None:
+        if catch_up:
+            # Текущий слот мог остаться необслуженным (рестарт, упавший воркер, тик на границе
+            # суток): планируем на его начало. Уже поставленное в этот слот outbox повторно не примет.
+            slot = self._slot(uid, now_utc)
+            offset = dt.timedelta(hours=tz_offset)
+            if (slot + offset).date() == (now_utc + offset).date():
+                now_utc = slot
+        at = next_due_at(now_utc, tz_offset, start_hour, self.interval_minutes, self._jitter(uid))
+        if at is None:
+            self._queue.discard(uid)
+            self._prefs.pop(uid, None)
+            return
+        self._prefs[uid] = (tz_offset, start_hour)
+        self._queue.push(uid, at)
+
+    def _jitter(self, uid: int) -> int:
+        return jitter_seconds(uid, self.interval_minutes) if self.jitter else 0
+
+    def _slot(self, uid: int, now_utc: dt.datetime) -> dt.datetime:
+        # граница интервала, к которой относится момент напоминания пользователя (с учётом сдвига)
+        return floor_to_interval(now_utc - dt.timedelta(seconds=self._jitter(uid)), self.interval_minutes)
+
+    async def _reschedule(
+        self, uids: list[int] | None, offsets: list[int] | None = None, shards: set[int] | None = None
+    ) -> None:
+        # uids=None and offsets=None: full rebuild; shards: users of newly acquired partitions.
+        # One query feeds both the agenda and the queue.
+        now = _utcnow()
+        rows = await self.db.select_agenda(now, uids=uids, offsets=offsets, shard=self._shard_filter(shards))
+        users: dict[int, tuple[int, int, str, list[int]]] = {}
+        for r in rows:
+            uid = int(r["uid"])
+            if uid not in users:
+                users[uid] = (int(r["tz_offset"]), int(r["start_hour"]), r["local_date"], [])
+            users[uid][3].append(int(r["id"]))
+        if uids is None and shards is None:
+            # целые бакеты: у их локального дня началась новая дата
+            buckets = set(offsets) if offsets is not None else set(TZ_OFFSETS) | {u[0] for u in users.values()}
+            for off in buckets:
+                self.agenda.load_bucket(
+                    off,
+                    (now + dt.timedelta(hours=off)).strftime("%Y-%m-%d"),
+                    ((uid, bid) for uid, u in users.items() if u[0] == off for bid in u[3]),
+                )
+        else:
+            for uid in users if uids is None else uids:
+                u = users.get(uid)
+                if u is None:
+                    self.agenda.discard_user(uid)
+                else:
+                    self.agenda.set_user(uid, u[0], u[2], u[3])
+        for uid, (tz_offset, start_hour, _, _) in users.items():
+            self._schedule(uid, tz_offset, start_hour, now, catch_up=uids is None)
+        for uid in uids or []:
+            if uid not in users:
+                self._queue.discard(uid)
+                self._prefs.pop(uid, None)
 
-    async def _tick_job(self):
-        await self.run_tick()
+    def _on_job_skipped(self, event) -> None:
+        reason = "overlap" if event.code == EVENT_JOB_MAX_INSTANCES else "missed"
+        JOBS_SKIPPED.inc(job=event.job_id, reason=reason)
+        # JobSubmissionEvent (overlap) несёт список запусков, JobExecutionEvent (missed) — один
+        when = getattr(event, "scheduled_run_time", None) or getattr(event, "scheduled_run_times", None)
+        logging.warning(f"Задача планировщика {event.job_id} пропущена ({reason}), запуск на {when}")
 
-    async def run_tick(self, only_uid: int | None = None):
-        # Подробное логирование «тика»: общее число ДР на сегодня, и по каждому пользователю
+    async def _day_start_job(self):
+        now = _utcnow()
+        offsets = [off for off in TZ_OFFSETS if (now + dt.timedelta(hours=off)).hour == 0]
+        if offsets:
+            await self._reschedule(None, offsets=offsets)
+            if self._wake is not None:
+                self._wake.set()
+        if now.hour == 0:
+            # отработанные задания outbox храним пару дней — для разбора, не для отправки
+            try:
+                await self.db.prune_outbox((now - dt.timedelta(days=2)).strftime("%Y-%m-%d"))
+            except Exception:
+                logging.exception("Outbox: не удалось удалить старые задания")
+
+    async def _run_loop(self):
         try:
-            now_utc = dt.datetime.utcnow()
+            if self.sharded:
+                # изменения, сделанные пока строится расписание, подберёт _shard_loop
+                self._change_seq = await self.db.last_change_seq()
+                await self._refresh_leases(initial=True)
+                self._shard_task = asyncio.get_running_loop().create_task(self._shard_loop())
+            await self._reschedule(None)
         except Exception:
-            now_utc = dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)
+            logging.exception("Не удалось построить расписание напоминаний")
+        logging.info(
+            f"Расписание напоминаний построено: пользователей в очереди {len(self._queue)}, записей в agenda {len(self.agenda)}"
+        )
+        while True:
+            self._wake.clear()
+            try:
+                if self._dirty:
+                    dirty = list(self._dirty)
+                    self._dirty.clear()
+                    await self._reschedule(dirty)
+                now = _utcnow()
+                earliest = self._queue.next_at()
+                due = self._queue.pop_due(now)
+                if due:
+                    self._note_lag(now, earliest)
+                    await self._run_due(due, now)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Ошибка в цикле планировщика напоминаний")
+            nxt = self._queue.next_at()
+            timeout = None if nxt is None else max(0.0, (nxt - _utcnow()).total_seconds())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _note_lag(self, now: dt.datetime, earliest: Optional[dt.datetime]) -> None:
+        if earliest is None:
+            return
+        lag = (now - earliest).total_seconds()
+        TICK_LAG_SECONDS.observe(max(0.0, lag))
+        if lag > self.interval_minutes * 60:
+            # кто-то из пользователей пропустил целый слот: цикл не успевает за расписанием
+            TICK_OVERRUNS.inc(reason="lag")
+            logging.warning(f"Тик отстаёт от расписания на {lag:.0f} с (интервал {self.interval_minutes} мин)")
+
+    async def _run_due(self, due: list[int], now: dt.datetime) -> None:
+        # Due-пользователи обрабатываются кусками в пределах tick_budget_ms. Остаток остаётся
+        # в очереди на «сейчас» в том же порядке — следующий проход начнёт с него, а не сначала.
+        started = time.monotonic()
+        later = now + dt.timedelta(seconds=1)
+        for i in range(0, len(due), TICK_CHUNK):
+            chunk = due[i:i + TICK_CHUNK]
+            await self.run_tick(uids=chunk, now_utc=now)
+            # следующий раз — на следующей границе интервала, пока не кончился локальный день
+            for uid in chunk:
+                prefs = self._prefs.get(uid)
+                if prefs is not None:
+                    self._schedule(uid, prefs[0], prefs[1], later)
+            rest = due[i + TICK_CHUNK:]
+            if rest and (time.monotonic() - started) * 1000 >= self.tick_budget_ms:
+                for uid in rest:
+                    self._queue.push(uid, now)
+                TICK_OVERRUNS.inc(reason="budget")
+                logging.warning(
+                    f"Тик исчерпал бюджет {self.tick_budget_ms} мс: обработано {i + len(chunk)}, "
+                    f"{len(rest)} пользователей перенесено на следующий проход"
+                )
+                return
+
+    async def run_tick(self, uids: list[int], now_utc: dt.datetime | None = None) -> int:
+        # «Тик» только ставит задания в outbox; отправляет их _drain_loop
+        started = time.perf_counter()
+        if now_utc is None:
+            now_utc = _utcnow()
 
         # Время «тика» в TZ планировщика
         try:
@@ -89,99 +421,201 @@ class ReminderService:
             tznow = dt.datetime.now()
         tick_str = tznow.strftime("%H:%M")
 
-        # Используем календарную дату по UTC для общего счёта, как и прежде
-        mm_total = f"{now_utc.month:02d}"
-        dd_total = f"{now_utc.day:02d}"
+        # Тик читает только agenda в памяти: пользователей будит DueQueue уже внутри их окна
+        items = self.agenda.due(uids)
+        # Задание помечается границей интервала пользователя: повтор того же тика после рестарта
+        # ничего не переотправит. Со сдвигом в тике встречаются слоты двух соседних границ.
+        slots: dict[dt.datetime, list[tuple[int, int, str]]] = {}
+        for item in items:
+            slots.setdefault(self._slot(item[0], now_utc), []).append(item)
         try:
-            all_today = await self.db.select_today_all(mm_total, dd_total)
-            logging.info(f"В тик {tick_str} получено {len(all_today)} дня рождения")
+            queued = 0
+            for slot, group in slots.items():
+                queued += await self.db.enqueue_outbox(group, slot)
         except Exception:
-            logging.info(f"В тик {tick_str} получено неизвестно сколько дней рождений (ошибка выборки)")
-
-        uids = await self.db.list_uids_with_birthdays()
-        if only_uid is not None:
-            uids = [uid for uid in uids if uid == only_uid]
+            logging.exception(f"В тик {tick_str} не удалось поставить напоминания в очередь")
+            return 0
+        logging.info(f"В тик {tick_str} к отправке {len(items)} напоминаний, поставлено в очередь {queued}")
+        TICK_SECONDS.observe(time.perf_counter() - started)
+        TICK_USERS.inc(len(uids))
+        TICK_DUE.inc(len(items))
+        for uid, n in Counter(uid for uid, _, _ in items).items():
+            logging.info(f"пользователю {uid} в очередь {n} уведомления с напоминанием")
+        if queued and self._outbox_wake is not None:
+            self._outbox_wake.set()
+        return queued
 
-        for uid in uids:
-            # Персональные настройки
-            try:
-                prefs = await self.db.get_user_prefs(uid)
-                tz_offset = int(prefs["tz_offset"]) if prefs else 0
-                start_hour = int(prefs["start_hour"]) if prefs else 0
-            except Exception:
-                tz_offset, start_hour = 0, 0
+    async def check_today(self, uid: int) -> TodayReport:
+        """Manual /today for one user: only their prefs and today's rows are read, what is
+        due is sent right away (not via _drain_loop, which may live in a worker process)."""
+        tz_offset, start_hour = await self.db.get_prefs(uid)
+        now = _utcnow()
+        local = now + dt.timedelta(hours=tz_offset)
+        local_date = local.strftime("%Y-%m-%d")
+        report = TodayReport(start_hour=start_hour)
+        due: list[tuple[int, int, str]] = []
+        for row in await self.db.select_user_today(uid, local_date):
+            report.total += 1
+            if row["notified_on"] == local_date:
+                report.done += 1
+            elif local.hour < start_hour:
+                report.waiting += 1
+            else:
+                due.append((uid, int(row["id"]), local_date))
+        if not due:
+            return report
+        # слот «сейчас»: задание, уже отправленное плановым тиком, перевзводится и напомнит ещё раз
+        await self.db.enqueue_outbox(due, now)
+        rows = await self.db.claim_outbox(_utcnow(), len(due), uids=[uid])
+        # в отправке — только реально незавершённые задания, кроме взятых сейчас нами;
+        # задание, уже отправленное в этом же слоте, не перевзводится и сюда не попадает
+        claimed = {int(r["id"]) for r in rows}
+        report.in_flight = await self.db.count_outbox_in_flight(
+            uid, local_date, [bid for _, bid, _ in due if bid not in claimed]
+        )
+        if rows:
+            delivered = await self._deliver(rows)
+            report.sent, report.failed = delivered.sent, delivered.failed
+        logging.info(
+            f"/today пользователя {uid}: ДР {report.total}, поздравлены {report.done}, ждут окна {report.waiting}, "
+            f"отправлено {report.sent}, ошибок {report.failed}, уже в отправке {report.in_flight}"
+        )
+        return report
 
-            local_now = now_utc + dt.timedelta(hours=tz_offset)
-            mm = f"{local_now.month:02d}"
-            dd = f"{local_now.day:02d}"
+    async def outbox_depth(self) -> int:
+        depth = await self.db.outbox_depth()
+        return depth.get("pending", 0) + depth.get("sending", 0)
 
-            # Все сегодняшние ДР пользователя и те, которые ещё не напоминались
+    async def _drain_loop(self):
+        # Отправка из outbox: берём пачку due-заданий, шлём пулом воркеров, отмечаем результат.
+        # Без шардов процесс один: после рестарта всё, что застряло в 'sending', — наше.
+        # Воркеры возвращают брошенные отправки своих разделов в _refresh_leases.
+        if not self.sharded:
             try:
-                rows_all = await self.db.select_user_today_all(uid, mm, dd)
+                requeued = await self.db.requeue_inflight_outbox()
+                if requeued:
+                    logging.info(f"Outbox: {requeued} незавершённых отправок возвращены в очередь")
             except Exception:
-                rows_all = []
+                logging.exception("Outbox: не удалось вернуть незавершённые отправки")
+        while True:
+            self._outbox_wake.clear()
             try:
-                rows_todo = await self.db.select_user_today_not_notified(uid, mm, dd)
+                rows = await self.db.claim_outbox(_utcnow(), self.outbox_batch, shard=self._shard_filter())
+                if rows:
+                    await self._deliver(rows)
+                    continue
+            except asyncio.CancelledError:
+                raise
             except Exception:
-                rows_todo = []
+                logging.exception("Ошибка в цикле отправки outbox")
+            # ждём нового тика; раз в OUTBOX_POLL_S — на случай отложенных повторов
+            try:
+                await asyncio.wait_for(self._outbox_wake.wait(), OUTBOX_POLL_S)
+            except asyncio.TimeoutError:
+                pass
 
-            # Окно отправки: [start_hour, 23]
-            if not (start_hour <= local_now.hour <= 23):
-                sign = "+" if tz_offset >= 0 else ""
-                logging.info(
-                    f"пользователю {uid} отправлены 0 уведомлений. причина время не пришло, старт уведомлений с {start_hour:02d}:00 (UTC {sign}{tz_offset})"
-                )
-                continue
+    async def _deliver(self, rows) -> DeliveryReport:
+        sent: dict[int, int] = {}
+        errors: dict[int, int] = {}
+
+        async def failed(row, e: Exception) -> None:
+            attempts = int(row["attempts"]) + 1
+            # бот заблокирован / чат удалён — повторять бессмысленно
+            retry_at = None
+            if not isinstance(e, TelegramForbiddenError) and attempts < self.outbox_max_attempts:
+                retry_at = _utcnow() + dt.timedelta(seconds=min(OUTBOX_RETRY_MAX_S, OUTBOX_RETRY_BASE_S * 2 ** (attempts - 1)))
+            await self.db.mark_outbox_failed(int(row["outbox_id"]), f"{type(e).__name__}: {e}", retry_at)
 
-            sent = 0
-            errors = 0
-            for row in rows_todo:
+        def make_job(uid: int, group: list):
+            async def job():
                 try:
-                    await self._send_or_replace_notification(uid, row)
-                    sent += 1
+                    if len(group) == 1 and not group[0]["digest"]:
+                        await self._send_or_replace_notification(uid, group[0])
+                    else:
+                        await self._send_digest(uid, group)
                 except Exception as e:
-                    errors += 1
-                    logging.exception(f"Ошибка отправки уведомления пользователю {uid} по записи id={int(row['id'])}: {e}")
-
-            already = max(0, len(rows_all) - len(rows_todo))
-            # Сформируем текст по аналогии с примерами
-            base = f"пользователю {uid} отправлены {sent} уведомления с напоминанием"
-            tails: list[str] = []
-            if already:
-                tails.append(f"{already} не отправлено, причина уже поздравил")
-            if errors:
-                tails.append(f"{errors} не отправлено, причина ошибка отправки")
-            msg = base + (", " + ", ".join(tails) if tails else "")
+                    errors[uid] = errors.get(uid, 0) + 1
+                    ids = ", ".join(str(int(row["id"])) for row in group)
+                    logging.exception(f"Ошибка отправки уведомления пользователю {uid} по записи id={ids}: {e}")
+                    for row in group:
+                        await failed(row, e)
+                    raise
+                for row in group:
+                    await self.db.mark_outbox_sent(int(row["outbox_id"]))
+                sent[uid] = sent.get(uid, 0) + 1
+
+            return job
+
+        # режим сводки: все задания пользователя — одно сообщение; иначе — по заданию на ДР
+        jobs = []
+        digests: dict[int, list] = {}
+        for row in rows:
+            uid = int(row["uid"])
+            if row["digest"]:
+                digests.setdefault(uid, []).append(row)
+            else:
+                jobs.append(make_job(uid, [row]))
+        jobs += [make_job(uid, group) for uid, group in digests.items()]
+        report = await self.delivery.run(jobs)
+        NOTIFICATIONS.inc(report.sent, result="sent")
+        NOTIFICATIONS.inc(report.failed, result="failed")
+
+        for uid in dict.fromkeys(int(row["uid"]) for row in rows):
+            msg = f"пользователю {uid} отправлены {sent.get(uid, 0)} уведомления с напоминанием"
+            if errors.get(uid):
+                msg += f", {errors[uid]} не отправлено, причина ошибка отправки"
             logging.info(msg)
+        logging.info(
+            f"Доставка: отправлено {report.sent}, ошибок {report.failed} за {report.elapsed:.2f} с "
+            f"({report.throughput:.1f} напоминаний/с)"
+        )
+        return report
 
     async def _send_or_replace_notification(self, uid: int, row):
         bid = int(row["id"]) 
-        last = await self.db.get_last_notification(uid, bid)
-        if last:
-            try:
-                await self.bot.delete_message(chat_id=uid, message_id=int(last["message_id"]))
-            except TelegramBadRequest:
-                pass
-            # delete extra if exists
-            try:
-                extra_id = last["extra_message_id"] if "extra_message_id" in last.keys() else None
-                if extra_id:
-                    await self.bot.delete_message(chat_id=uid, message_id=int(extra_id))
-            except TelegramBadRequest:
-                pass
+        if "last_message_id" in row.keys():
+            # строка из claim_outbox уже содержит last_notifications
+            last_mid = row["last_message_id"]
+            last_extra = row["last_extra_message_id"]
+            last_date = row["last_date"]
+            last_count = row["last_repeat_count"]
+        else:
+            last = await self.db.get_last_notification(uid, bid)
+            last_mid = last["message_id"] if last else None
+            last_extra = last["extra_message_id"] if last and "extra_message_id" in last.keys() else None
+            last_date = last["date"] if last else None
+            last_count = last["repeat_count"] if last else 0
+        if "local_date" in row.keys():
+            local_date = row["local_date"]
+        elif "local_ts" in row.keys():
+            local_date = row["local_ts"][:10]
+        else:
+            local_date = today_str()
+        # номер напоминания за этот локальный день
+        repeat = (int(last_count or 0) if last_mid and last_date == local_date else 0) + 1
 
         # Decide message type: text with link (if username present) or contact card (if phone present),
         # otherwise plain text with a button to link contact.
         tg_nic: Optional[str] = row["tg_nic"] if "tg_nic" in row.keys() else None
         phone: Optional[str] = row["phone"] if "phone" in row.keys() else None
+        text = self._build_message_text(row, repeat)
+
+        # Повтор в тот же день: правим уже отправленное сообщение (1 вызов вместо удаления + отправки),
+        # новый пуш — только когда этого требует reping_every
+        if repeat > 1 and not self._needs_push(repeat):
+            if await self._edit_notification(uid, bid, text, last_mid, last_extra, tg_nic, phone):
+                await self.db.set_notification_repeat(uid, bid, repeat)
+                return
+
+        if last_mid:
+            # старое уведомление (и карточку контакта) удалит фоновый чистильщик одним вызовом
+            self.cleaner.delete(uid, last_mid, last_extra)
 
         extra_id: int | None = None
         if tg_nic:
-            text = self._build_message_text(row)
             msg = await self.bot.send_message(chat_id=uid, text=text, reply_markup=reminder_keyboard(bid))
         elif phone:
             # Send text first, then contact card so user sees context + has Write button
-            text = self._build_message_text(row)
             extra = await self.bot.send_message(chat_id=uid, text=text, reply_markup=reminder_keyboard(bid))
             extra_id = extra.message_id
             friend = row["friend"]
@@ -196,11 +630,42 @@ class ReminderService:
                 reply_markup=reminder_keyboard(bid),
             )
         else:
-            text = self._build_message_text(row)
             msg = await self.bot.send_message(chat_id=uid, text=text, reply_markup=reminder_keyboard(bid, with_link=True))
-        await self.db.upsert_last_notification(uid, bid, msg.message_id, today_str(), extra_message_id=extra_id)
+        await self.db.upsert_last_notification(
+            uid, bid, msg.message_id, local_date, extra_message_id=extra_id, repeat_count=repeat
+        )
 
-    def _build_message_text(self, row) -> str:
+    def _needs_push(self, repeat: int) -> bool:
+        # reping_every=N: каждое N-е напоминание дня — новым сообщением (1 — всегда, 0 — только первое)
+        return self.reping_every > 0 and (repeat - 1) % self.reping_every == 0
+
+    async def _edit_notification(
+        self,
+        uid: int,
+        bid: int,
+        text: str,
+        last_mid,
+        last_extra,
+        tg_nic: Optional[str],
+        phone: Optional[str],
+    ) -> bool:
+        # Текст живёт в extra-сообщении, если к напоминанию приложена карточка контакта.
+        # Если вид напоминания с тех пор поменялся (добавили ник/телефон) — шлём заново.
+        with_contact = bool(phone) and not tg_nic
+        if with_contact != bool(last_extra):
+            return False
+        target = last_extra if with_contact else last_mid
+        keyboard = reminder_keyboard(bid, with_link=not tg_nic and not phone)
+        try:
+            await self.bot.edit_message_text(chat_id=uid, message_id=int(target), text=text, reply_markup=keyboard)
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return True
+            # сообщение удалено пользователем или слишком старое — отправим новое
+            return False
+        return True
+
+    def _build_message_text(self, row, repeat: int = 1) -> str:
         friend = row["friend"]
         date = row["date"]
         tg_nic: Optional[str] = row["tg_nic"] if "tg_nic" in row.keys() else None
@@ -213,42 +678,113 @@ class ReminderService:
             if nick.startswith("@"):
                 nick = nick[1:]
             message += f"\nПрофиль: https://t.me/{nick}"
+        if repeat > 1:
+            message += f"\n\n🔔 Напоминание #{repeat}"
         return message
 
+    async def _send_digest(self, uid: int, rows) -> None:
+        # Сводка перечисляет все несделанные на сегодня ДР пользователя, не только поставленные
+        # в этот тик: у отложенного на время повтора задания строки в сводке не пропадают.
+        local_date = rows[0]["local_date"]
+        today = [r for r in await self.db.select_user_today(uid, local_date) if r["notified_on"] != local_date]
+        if not today:
+            return
+        last = await self.db.get_last_digest(uid)
+        repeat = (int(last["repeat_count"]) if last and last["date"] == local_date else 0) + 1
+        shown = today[:DIGEST_MAX_ROWS]
+        text = self._build_digest_text(shown, repeat, more=len(today) - len(shown))
+        keyboard = digest_keyboard(shown)
+        ids = [int(r["id"]) for r in shown]
+        if repeat > 1 and not self._needs_push(repeat):
+            try:
+                await self.bot.edit_message_text(chat_id=uid, message_id=int(last["message_id"]), text=text, reply_markup=keyboard)
+                await self.db.upsert_last_digest(uid, int(last["message_id"]), local_date, ids, repeat)
+                return
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    await self.db.upsert_last_digest(uid, int(last["message_id"]), local_date, ids, repeat)
+                    return
+                # сводку удалили или она слишком старая — отправим новую
+        if last:
+            self.cleaner.delete(uid, last["message_id"])
+        msg = await self.bot.send_message(chat_id=uid, text=text, reply_markup=keyboard)
+        await self.db.upsert_last_digest(uid, msg.message_id, local_date, ids, repeat)
+
+    def _build_digest_text(self, rows, repeat: int = 1, more: int = 0) -> str:
+        lines = [f"Сегодня дни рождения ({len(rows) + more}) — не забудь поздравить:"]
+        for row in rows:
+            line = f"• {html.quote(row['friend'])} ({human_date_short(row['date'])})"
+            age = get_age_text(row["date"])
+            if age:
+                line += f", исполняется {age}"
+            nick = (row["tg_nic"] or "").strip().lstrip("@")
+            if nick:
+                line += f" — https://t.me/{nick}"
+            elif row["phone"]:
+                line += f" — {html.quote(row['phone'])}"
+            lines.append(line)
+        if more:
+            lines.append(f"…и ещё {more}")
+        if repeat > 1:
+            lines.append(f"\n🔔 Напоминание #{repeat}")
+        return "\n".join(lines)
+
+    async def _refresh_digest(self, uid: int, last, bid: int) -> None:
+        # «Уже поздравил»/«Отложить» в сводке: убираем строку, правя то же сообщение.
+        # Отложенный ДР вернётся в сводку следующего интервала.
+        keep = [int(b) for b in last["birthday_ids"].split(",") if b and int(b) != bid]
+        date = last["date"]
+        today = await self.db.select_user_today(uid, date)
+        rows = [r for r in today if int(r["id"]) in keep and r["notified_on"] != date]
+        rows.sort(key=lambda r: keep.index(int(r["id"])))
+        if rows:
+            text = self._build_digest_text(rows, int(last["repeat_count"]))
+            keyboard: Optional[InlineKeyboardMarkup] = digest_keyboard(rows)
+        elif all(r["notified_on"] == date for r in today):
+            text, keyboard = "Все на сегодня поздравлены 🎉", None
+        else:
+            text, keyboard = "Остальных напомню позже.", None
+        try:
+            await self.bot.edit_message_text(chat_id=uid, message_id=int(last["message_id"]), text=text, reply_markup=keyboard)
+        except TelegramBadRequest:
+            pass
+        await self.db.set_digest_birthdays(uid, [int(r["id"]) for r in rows])
+
+    async def _digest_for(self, uid: int, message_id: Optional[int]):
+        # нажата кнопка в сводке (а не в отдельном напоминании)?
+        if message_id is None:
+            return None
+        last = await self.db.get_last_digest(uid)
+        return last if last and int(last["message_id"]) == int(message_id) else None
+
     # Public handlers used by callbacks
-    async def handle_done(self, uid: int, bid: int):
-        await self.db.mark_notified_today(uid, bid)
+    async def _user_today(self, uid: int) -> str:
+        tz_offset, _ = await self.db.get_prefs(uid)
+        return local_today_str(tz_offset)
+
+    async def handle_done(self, uid: int, bid: int, message_id: Optional[int] = None):
+        await self.db.mark_notified_today(uid, bid, await self._user_today(uid))
+        digest = await self._digest_for(uid, message_id)
+        if digest:
+            await self._refresh_digest(uid, digest, bid)
+            return
         last = await self.db.get_last_notification(uid, bid)
         if last:
-            try:
-                await self.bot.delete_message(chat_id=uid, message_id=int(last["message_id"]))
-            except TelegramBadRequest:
-                pass
-            try:
-                extra_id = last["extra_message_id"] if "extra_message_id" in last.keys() else None
-                if extra_id:
-                    await self.bot.delete_message(chat_id=uid, message_id=int(extra_id))
-            except TelegramBadRequest:
-                pass
+            self.cleaner.delete(uid, last["message_id"], last["extra_message_id"])
         await self.bot.send_message(chat_id=uid, text="Отлично! Больше не буду напоминать сегодня.")
 
-    async def handle_snooze(self, uid: int, bid: int):
+    async def handle_snooze(self, uid: int, bid: int, message_id: Optional[int] = None):
         # Отложить: удалить текущее уведомление и очистить запись last_notifications.
         # Новое уведомление придёт на следующем тике планировщика.
+        digest = await self._digest_for(uid, message_id)
+        if digest:
+            await self._refresh_digest(uid, digest, bid)
+            return
         row = await self.db.get_birthday(uid, bid)
         if not row:
             return
         last = await self.db.get_last_notification(uid, bid)
         if last:
-            try:
-                await self.bot.delete_message(chat_id=uid, message_id=int(last["message_id"]))
-            except TelegramBadRequest:
-                pass
-            try:
-                extra_id = last["extra_message_id"] if "extra_message_id" in last.keys() else None
-                if extra_id:
-                    await self.bot.delete_message(chat_id=uid, message_id=int(extra_id))
-            except TelegramBadRequest:
-                pass
+            self.cleaner.delete(uid, last["message_id"], last["extra_message_id"])
             await self.db.delete_last_notification(uid, bid)
         # Ничего не отправляем сейчас — это и есть «отложить»
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import datetime as dt
+import heapq
+from typing import Optional
+
+
+EPOCH = dt.datetime(1970, 1, 1)
+
+
+def ceil_to_interval(t: dt.datetime, interval_minutes: int) -> dt.datetime:
+    """First wall-clock boundary of the interval at or after t (naive UTC).
+    For intervals dividing 60 these are the same :00, :N, ... points the old cron job used.
+    """
+    step = max(1, interval_minutes) * 60
+    ts = int((t - EPOCH).total_seconds())
+    if t.microsecond == 0 and ts % step == 0:
+        return t
+    return EPOCH + dt.timedelta(seconds=(ts // step + 1) * step)
+
+
+def floor_to_interval(t: dt.datetime, interval_minutes: int) -> dt.datetime:
+    """Last wall-clock boundary of the interval at or before t (naive UTC)."""
+    step = max(1, interval_minutes) * 60
+    ts = int((t - EPOCH).total_seconds())
+    return EPOCH + dt.timedelta(seconds=ts // step * step)
+
+
+def jitter_seconds(uid: int, interval_minutes: int) -> int:
+    """Stable offset of the user inside the interval, in [0, interval) seconds."""
+    step = max(1, interval_minutes) * 60
+    # multiplicative (Knuth) hash: neighbouring uids land far apart, not in consecutive seconds
+    return ((uid * 2654435761) & 0xFFFFFFFF) * step >> 32
+
+
+def next_due_at(
+    now_utc: dt.datetime, tz_offset: int, start_hour: int, interval_minutes: int, jitter_s: int = 0
+) -> Optional[dt.datetime]:
+    """Next instant (naive UTC) a user with pending birthdays on their local today should be
+    reminded: the first interval boundary (shifted by jitter_s) inside [start_hour:00, 24:00)
+    local that is not in the past; None if the local day's window is already over.
+    """
+    offset = dt.timedelta(hours=tz_offset)
+    local = now_utc + offset
+    day_start = local.replace(hour=0, minute=0, second=0, microsecond=0) - offset
+    window_start = day_start + dt.timedelta(hours=start_hour)
+    window_end = day_start + dt.timedelta(days=1)
+    jitter = dt.timedelta(seconds=jitter_s)
+    at = ceil_to_interval(max(now_utc, window_start) - jitter, interval_minutes) + jitter
+    return at if at < window_end else None
+
+
+class DueQueue:
+    """Min-heap of (due instant, uid) with one live entry per uid.
+    Rescheduling a uid leaves its old heap entry behind; stale entries are skipped on pop.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[dt.datetime, int]] = []
+        self._when: dict[int, dt.datetime] = {}
+
+    def push(self, uid: int, when: dt.datetime) -> None:
+        if self._when.get(uid) == when:
+            return
+        self._when[uid] = when
+        heapq.heappush(self._heap, (when, uid))
+        # не даём куче распухнуть от устаревших записей
+        if len(self._heap) > 2 * len(self._when) + 64:
+            self._heap = [(w, u) for u, w in self._when.items()]
+            heapq.heapify(self._heap)
+
+    def discard(self, uid: int) -> None:
+        self._when.pop(uid, None)
+
+    def when(self, uid: int) -> Optional[dt.datetime]:
+        return self._when.get(uid)
+
+    def next_at(self) -> Optional[dt.datetime]:
+        while self._heap:
+            when, uid = self._heap[0]
+            if self._when.get(uid) == when:
+                return when
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: dt.datetime) -> list[int]:
+        due: list[int] = []
+        while self._heap and self._heap[0][0] <= now:
+            when, uid = heapq.heappop(self._heap)
+            if self._when.get(uid) == when:
+                del self._when[uid]
+                due.append(uid)
+        return due
+
+    def __len__(self) -> int:
+        return len(self._when)
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self._when
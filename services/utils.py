@@ -1,9 +1,9 @@
 from __future__ import annotations
 
 import datetime as dt
-from typing import Optional, Tuple
+from itertools import chain
+from typing import Iterable, Iterator, Optional, Tuple
 import csv
-import io
 
 
 def parse_date_input(text: str) -> Tuple[str, str]:
@@ -87,6 +87,17 @@ def today_str() -> str:
     return t.strftime("%Y-%m-%d")
 
 
+def local_now(tz_offset: int, now_utc: Optional[dt.datetime] = None) -> dt.datetime:
+    # naive local time for an integer UTC offset (user_prefs.tz_offset)
+    if now_utc is None:
+        now_utc = dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)
+    return now_utc + dt.timedelta(hours=tz_offset)
+
+
+def local_today_str(tz_offset: int, now_utc: Optional[dt.datetime] = None) -> str:
+    return local_now(tz_offset, now_utc).strftime("%Y-%m-%d")
+
+
 def days_until_next(date_str: str, today: Optional[dt.date] = None) -> int:
     """Return number of days until next occurrence of given YYYY-MM-DD (year may be 0000).
     Handles 29 Feb by mapping to 28 Feb on non-leap years.
@@ -130,63 +141,77 @@ def _sniff_delimiter(sample: str) -> str:
         return "\t"
 
 
-def parse_bulk_text(text: str) -> tuple[list[dict], list[str]]:
-    """Parse multiline CSV/text into list of {friend,date,phone?,tg_nic?} and errors.
-    - Accepts optional header (name/friend, date, phone, tg/tg_nic/username)
-    - Accepts ; , or tab delimiters
-    - Blank lines are ignored
-    - Date format: DD.MM or DD.MM.YYYY
+def _norm_header(h: str) -> str:
+    h = h.strip().lower()
+    mapping = {
+        "name": "friend",
+        "имя": "friend",
+        "friend": "friend",
+        "date": "date",
+        "дата": "date",
+        "phone": "phone",
+        "телефон": "phone",
+        "tg": "tg_nic",
+        "username": "tg_nic",
+        "tg_nic": "tg_nic",
+    }
+    return mapping.get(h, h)
+
+
+class BulkParser:
+    """Incremental parse_bulk_text: feed() lines as they arrive (a file being downloaded),
+    get (item, None) or (None, error) back for each non-blank line. The delimiter and
+    the optional header are detected from the first 5 non-blank lines, so those are
+    held back until the fifth one arrives or close() is called.
     """
-    lines = [ln for ln in text.splitlines() if ln.strip()]
-    if not lines:
-        return [], []
-    sample = "\n".join(lines[:5])
-    delim = _sniff_delimiter(sample)
-    buf = io.StringIO("\n".join(lines))
-    reader = csv.reader(buf, delimiter=delim)
-
-    headers = None
-    peek = lines[0].lower()
-    if any(h in peek for h in ["name", "имя", "friend"]) and ("date" in peek or "дата" in peek):
-        headers = next(reader, None)
-
-    def norm_header(h: str) -> str:
-        h = h.strip().lower()
-        mapping = {
-            "name": "friend",
-            "имя": "friend",
-            "friend": "friend",
-            "date": "date",
-            "дата": "date",
-            "phone": "phone",
-            "телефон": "phone",
-            "tg": "tg_nic",
-            "username": "tg_nic",
-            "tg_nic": "tg_nic",
-        }
-        return mapping.get(h, h)
 
-    items: list[dict] = []
-    errors: list[str] = []
-
-    if headers:
-        idx = {norm_header(h): i for i, h in enumerate(headers)}
-        for i, row in enumerate(reader, start=2):
-            try:
+    SAMPLE_LINES = 5
+
+    def __init__(self) -> None:
+        self.line_no = 0
+        self.delim: Optional[str] = None
+        self.idx: Optional[dict[str, int]] = None
+        self._sample: list[tuple[int, str]] = []
+
+    def feed(self, lines: Iterable[str]) -> Iterator[tuple[Optional[dict], Optional[str]]]:
+        for line in lines:
+            self.line_no += 1
+            if not line.strip():
+                continue
+            if self.delim is None:
+                self._sample.append((self.line_no, line))
+                if len(self._sample) >= self.SAMPLE_LINES:
+                    yield from self._start()
+                continue
+            yield self._row(self.line_no, line)
+
+    def close(self) -> Iterator[tuple[Optional[dict], Optional[str]]]:
+        if self.delim is None and self._sample:
+            yield from self._start()
+
+    def _start(self) -> Iterator[tuple[Optional[dict], Optional[str]]]:
+        sample, self._sample = self._sample, []
+        self.delim = _sniff_delimiter("\n".join(ln for _, ln in sample))
+        peek = sample[0][1].lower()
+        if any(h in peek for h in ["name", "имя", "friend"]) and ("date" in peek or "дата" in peek):
+            headers = next(csv.reader([sample[0][1]], delimiter=self.delim))
+            self.idx = {_norm_header(h): i for i, h in enumerate(headers)}
+            sample = sample[1:]
+        for n, line in sample:
+            yield self._row(n, line)
+
+    def _row(self, n: int, line: str) -> tuple[Optional[dict], Optional[str]]:
+        row = next(csv.reader([line], delimiter=self.delim))
+        idx = self.idx
+        try:
+            if idx:
+                if len(row) <= max(idx.get("friend", 0), idx.get("date", 1)):
+                    raise ValueError("не хватает колонок")
                 friend = row[idx.get("friend", 0)].strip()
                 date_raw = row[idx.get("date", 1)].strip()
                 phone = row[idx["phone"]].strip() if "phone" in idx and idx["phone"] < len(row) else None
                 tg = row[idx["tg_nic"]].strip() if "tg_nic" in idx and idx["tg_nic"] < len(row) else None
-                norm, _ = parse_date_input(date_raw)
-                if tg and tg.startswith("@"): tg = tg[1:]
-                if not friend:
-                    raise ValueError("пустое имя")
-                items.append({"friend": friend, "date": norm, "phone": phone or None, "tg_nic": tg or None})
-            except Exception as e:
-                errors.append(f"Строка {i}: {e}")
-    else:
-        for i, row in enumerate(reader, start=1):
-            try:
+            else:
                 # friend;date;[phone];[tg]
                 if len(row) < 2:
                     raise ValueError("ожидалось минимум 2 колонки")
@@ -194,11 +219,28 @@ def parse_bulk_text(text: str) -> tuple[list[dict], list[str]]:
                 date_raw = row[1].strip()
                 phone = row[2].strip() if len(row) > 2 else None
                 tg = row[3].strip() if len(row) > 3 else None
-                norm, _ = parse_date_input(date_raw)
-                if tg and tg.startswith("@"): tg = tg[1:]
-                if not friend:
-                    raise ValueError("пустое имя")
-                items.append({"friend": friend, "date": norm, "phone": phone or None, "tg_nic": tg or None})
-            except Exception as e:
-                errors.append(f"Строка {i}: {e}")
+            norm, _ = parse_date_input(date_raw)
+            if tg and tg.startswith("@"): tg = tg[1:]
+            if not friend:
+                raise ValueError("пустое имя")
+            return {"friend": friend, "date": norm, "phone": phone or None, "tg_nic": tg or None}, None
+        except Exception as e:
+            return None, f"Строка {n}: {e}"
+
+
+def parse_bulk_text(text: str) -> tuple[list[dict], list[str]]:
+    """Parse multiline CSV/text into list of {friend,date,phone?,tg_nic?} and errors.
+    - Accepts optional header (name/friend, date, phone, tg/tg_nic/username)
+    - Accepts ; , or tab delimiters
+    - Blank lines are ignored
+    - Date format: DD.MM or DD.MM.YYYY
+    """
+    parser = BulkParser()
+    items: list[dict] = []
+    errors: list[str] = []
+    for item, error in chain(parser.feed(text.splitlines()), parser.close()):
+        if item is not None:
+            items.append(item)
+        else:
+            errors.append(error)
     return items, errors
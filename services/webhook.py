@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import signal
+from typing import Any, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+
+# Сколько запрос ждёт свободного слота, прежде чем получить 503. Заметно меньше таймаута
+# Telegram: иначе он сочтёт доставку неудачной, пришлёт обновление снова, и оно
+# обработается дважды.
+SLOT_WAIT_S = 5.0
+
+
+def derive_secret(token: str) -> str:
+    # Stable across processes and restarts (every bot process must check the same value),
+    # yet not guessable without the token. Telegram allows A-Z, a-z, 0-9, _ and -.
+    return hashlib.sha256(f"webhook:{token}".encode()).hexdigest()
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """Answers Telegram right away and handles the update in the background, with at most
+    `max_concurrency` updates in flight. Past the limit the request waits up to
+    SLOT_WAIT_S for a free slot and then gets 503 without touching the update, so
+    Telegram redelivers it later and nothing piles up in memory. After drain() new
+    requests get 503 as well.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str], max_concurrency: int = 64, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.max_concurrency = max(1, max_concurrency)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._draining = False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._draining:
+            return web.Response(status=503)
+        return await super().handle(request)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        try:
+            await asyncio.wait_for(self._slots.acquire(), SLOT_WAIT_S)
+        except asyncio.TimeoutError:
+            return web.Response(status=503)
+        try:
+            update = await request.json(loads=bot.session.json_loads)
+        except BaseException:
+            self._slots.release()
+            raise
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        task.add_done_callback(lambda _: self._slots.release())
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def drain(self, timeout: float) -> None:
+        """Stop accepting updates and wait up to `timeout` seconds for the ones in flight."""
+        self._draining = True
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logging.info(f"Webhook: жду завершения {len(tasks)} обновлений")
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logging.warning(f"Webhook: {len(pending)} обновлений не успели обработаться за {timeout:.0f} с, прерываю")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def close(self) -> None:
+        # the bot session is shared with reminders and the cleaner; main.py closes it last
+        pass
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    *,
+    host: str,
+    port: int,
+    path: str = "/webhook",
+    url: str = "",
+    secret: Optional[str] = None,
+    max_concurrency: int = 64,
+    drain_timeout: float = 30.0,
+) -> None:
+    """Serve updates at http://host:port{path} until SIGINT/SIGTERM, then drain and stop.
+    With `url` the webhook is (re)registered at {url}{path}; without it the server only
+    listens, e.g. behind a proxy whose webhook is set elsewhere, or to POST recorded updates."""
+    handler = LimitedRequestHandler(dp, bot, secret_token=secret, max_concurrency=max_concurrency)
+    app = web.Application()
+    handler.register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Webhook: слушаю http://{host}:{port}{path}, одновременно до {handler.max_concurrency} обновлений")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: Ctrl+C arrives as KeyboardInterrupt and cancels the wait below
+            pass
+    try:
+        if url:
+            await bot.set_webhook(
+                url=url.rstrip("/") + path,
+                secret_token=secret,
+                max_connections=min(100, handler.max_concurrency),
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logging.info(f"Webhook зарегистрирован: {url.rstrip('/')}{path}")
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.remove_signal_handler(sig)
+            except (NotImplementedError, RuntimeError):
+                pass
+        # webhook не снимаем: Telegram придержит обновления до рестарта, а соседние процессы
+        # за тем же прокси продолжают их принимать
+        await handler.drain(drain_timeout)
+        await runner.cleanup()